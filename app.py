@@ -1,8 +1,18 @@
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-from utils import get_attendance, load_students, send_absent_emails, ensure_db
+from utils import (
+    get_attendance,
+    query_attendance,
+    attendance_summary,
+    query_students,
+    sync_students,
+    change_version,
+    roster_hash,
+)
 import os
 import json
+import datetime
+import hashlib
 from dotenv import load_dotenv
 
 
@@ -34,6 +44,13 @@ def serve_frontend(path):
 
 DB_PATH = os.getenv("DB_PATH", "attendance.db")
 STUDENTS_CSV = os.getenv("STUDENTS_CSV", "students.csv")
+MODEL_DIR = os.getenv("MODEL_DIR", "model")
+# Parquet archive of closed days (see attendance_archive.py)
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+RECOGNIZE_MAX_IMAGES = int(os.getenv("RECOGNIZE_MAX_IMAGES", "32"))
+# page size for /api/attendance range queries
+ATTENDANCE_PAGE_SIZE = int(os.getenv("ATTENDANCE_PAGE_SIZE", "500"))
+ATTENDANCE_MAX_PAGE_SIZE = int(os.getenv("ATTENDANCE_MAX_PAGE_SIZE", "5000"))
 
 
 # Read SMTP config from request body or environment
@@ -44,79 +61,337 @@ SMTP_CONFIG = {
     "pass": os.getenv("SMTP_PASS"),
     "use_tls": os.getenv("SMTP_USE_TLS", "True").lower() in ("1", "true", "yes"),
 }
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "4"))
+SMTP_RATE_LIMIT = float(os.getenv("SMTP_RATE_LIMIT", "0")) or None
+# Background delivery of queued absent notices; EMAIL_WORKER=0 disables it in this process
+EMAIL_WORKER = os.getenv("EMAIL_WORKER", "1").lower() in ("1", "true", "yes")
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "50"))
+# Daily absentee run (HH:MM local time); empty disables it
+ABSENT_EMAIL_TIME = os.getenv("ABSENT_EMAIL_TIME", "")
+
+outbox_worker = None
+if EMAIL_WORKER:
+    from email_outbox import OutboxWorker, start_scheduler
+
+    outbox_worker = OutboxWorker(
+        DB_PATH,
+        SMTP_CONFIG,
+        batch_size=EMAIL_BATCH_SIZE,
+        pool_size=SMTP_POOL_SIZE,
+        rate_limit=SMTP_RATE_LIMIT,
+    ).start()
+    if ABSENT_EMAIL_TIME:
+        start_scheduler(DB_PATH, STUDENTS_CSV, ABSENT_EMAIL_TIME, outbox_worker)
+
+
+@app.route("/api/health", methods=["GET"])
+def api_health():
+    """Cheap liveness check (used by streamlit_utils to close its circuit breaker)."""
+    return jsonify({"status": "ok"})
+
+
+def conditional_response(tables, build, *extra):
+    """
+    Answer a GET from the write counters of ``tables`` (see utils.change_version):
+    304 Not Modified when the client's If-None-Match (or, without it,
+    If-Modified-Since) still matches, otherwise build() with ETag and
+    Last-Modified set. The ETag covers the counters, the full request path and
+    ``extra``; Last-Modified has one-second resolution, so ETag wins when both are sent.
+    """
+    versions, updated_at = change_version(DB_PATH, *tables)
+    raw = json.dumps([versions, request.full_path, *extra], sort_keys=True)
+    etag = hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+    last_modified = datetime.datetime.fromtimestamp(int(updated_at), datetime.timezone.utc)
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    else:
+        since = request.if_modified_since
+        fresh = since is not None and since >= last_modified
+    if fresh:
+        resp = app.response_class(status=304)
+    else:
+        resp = build()
+        if isinstance(resp, tuple):
+            # errors are not cacheable
+            return resp
+    resp.set_etag(etag)
+    resp.last_modified = last_modified
+    # clients may keep the body but must revalidate before reusing it
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
+def _invalid_date(*values):
+    """Error response for the first value that is not YYYY-MM-DD, or None if all are valid (or empty)."""
+    for value in values:
+        if value:
+            try:
+                datetime.date.fromisoformat(value)
+            except (TypeError, ValueError):
+                return jsonify({"error": f"Invalid date: {value}"}), 400
+    return None
+
+
+def _invalid_int(args, *names):
+    """Error response for the first of the named query args that is not an integer, or None."""
+    for name in names:
+        for value in args.getlist(name):
+            if value:
+                try:
+                    int(value)
+                except ValueError:
+                    return jsonify({"error": f"Invalid {name}: {value}"}), 400
+    return None
 
 
 @app.route("/api/attendance", methods=["GET"])
 def api_get_attendance():
-    date_str = request.args.get("date")
-    rows = get_attendance(DB_PATH, date_str)
-    result = [{"id": r[0], "name": r[1], "date": r[2], "time": r[3]} for r in rows]
-    return jsonify(result)
+    invalid = _invalid_date(
+        *(request.args.get(k) for k in ("date", "from", "to"))
+    ) or _invalid_int(request.args, "student_id", "limit")
+    if invalid:
+        return invalid
+    # today's date is part of the validator, since requests without a date mean today
+    return conditional_response(
+        ("attendance",), _attendance_response, datetime.date.today().isoformat()
+    )
+
+
+def _attendance_response():
+    """Attendance rows as a JSON list.
+
+    date=YYYY-MM-DD (default today) returns that whole day. from/to (inclusive)
+    and/or student_id select a range instead, paged by limit (default
+    ATTENDANCE_PAGE_SIZE) with the next page's cursor in the X-Next-Cursor header.
+    group_by=day|student returns SQL aggregates for the same filters instead of rows.
+    """
+    args = request.args
+    date_from, date_to = args.get("from"), args.get("to")
+    student_id = args.get("student_id", type=int)
+    group_by = args.get("group_by")
+    ranged = date_from or date_to or student_id is not None or group_by
+    if not ranged and not args.get("cursor") and not args.get("limit"):
+        rows = get_attendance(DB_PATH, args.get("date"))
+        result = [{"id": r[0], "name": r[1], "date": r[2], "time": r[3]} for r in rows]
+        return jsonify(result)
+
+    if args.get("date") and not (date_from or date_to):
+        date_from = date_to = args.get("date")
+    try:
+        if group_by:
+            return jsonify(
+                attendance_summary(DB_PATH, date_from, date_to, student_id, group_by)
+            )
+        limit = min(
+            args.get("limit", ATTENDANCE_PAGE_SIZE, type=int), ATTENDANCE_MAX_PAGE_SIZE
+        )
+        rows, next_cursor = query_attendance(
+            DB_PATH, date_from, date_to, student_id, args.get("cursor"), max(1, limit)
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    resp = jsonify(
+        [{"id": r[0], "name": r[1], "date": r[2], "time": r[3]} for r in rows]
+    )
+    if next_cursor:
+        resp.headers["X-Next-Cursor"] = next_cursor
+    return resp
 
 
 @app.route("/api/students", methods=["GET"])
 def api_get_students():
-    students = load_students(STUDENTS_CSV)
+    invalid = _invalid_date(request.args.get("absent_on")) or _invalid_int(
+        request.args, "id", "limit", "offset"
+    )
+    if invalid:
+        return invalid
+    # import a changed students.csv first, so the validators reflect it
+    sync_students(STUDENTS_CSV, DB_PATH)
+    tables = ("students", "attendance") if request.args.get("absent_on") else ("students",)
+    return conditional_response(
+        tables, _students_response, roster_hash(STUDENTS_CSV, DB_PATH)
+    )
+
+
+def _students_response():
+    """Roster from the DB (re-imported when students.csv changes).
+
+    Optional filters: q (name/email substring), id (repeatable), has_email=1|0,
+    absent_on=YYYY-MM-DD, limit and offset.
+    """
+    args = request.args
+    has_email = args.get("has_email")
+    students = query_students(
+        DB_PATH,
+        STUDENTS_CSV,
+        q=args.get("q"),
+        ids=args.getlist("id", type=int),
+        has_email=None if has_email is None else has_email.lower() in ("1", "true", "yes"),
+        absent_on=args.get("absent_on"),
+        limit=args.get("limit", type=int),
+        offset=args.get("offset", 0, type=int),
+    )
     return jsonify(students)
 
 
 @app.route("/api/send_absent_emails", methods=["POST"])
 def api_send_absent_emails():
-    body = request.json or {}
-    smtp = body.get("smtp", SMTP_CONFIG)
-    date_str = body.get("date")
-    sent = send_absent_emails(smtp, STUDENTS_CSV, DB_PATH, date_str)
-    return jsonify({"sent": sent})
+    """Queue absent notices for a date and return at once; a background worker sends them."""
+    from email_outbox import enqueue_absent_emails
+
+    body = request.get_json(silent=True) or {}
+    invalid = _invalid_date(body.get("date"))
+    if invalid:
+        return invalid
+    job_id, queued = enqueue_absent_emails(
+        DB_PATH, STUDENTS_CSV, body.get("date"), body.get("smtp")
+    )
+    if outbox_worker is not None:
+        outbox_worker.wake()
+    return jsonify({"job_id": job_id, "queued": queued}), 202
+
+
+@app.route("/api/email_jobs", methods=["GET"])
+def api_email_jobs():
+    from email_outbox import list_jobs
+
+    invalid = _invalid_int(request.args, "limit")
+    if invalid:
+        return invalid
+    limit = request.args.get("limit", 20, type=int)
+    return jsonify(list_jobs(DB_PATH, limit))
+
+
+@app.route("/api/email_jobs/<int:job_id>", methods=["GET"])
+def api_email_job(job_id):
+    from email_outbox import get_job
+
+    job = get_job(DB_PATH, job_id)
+    if job is None:
+        return jsonify({"error": "No such job"}), 404
+    return jsonify(job)
 
 
 @app.route("/api/export_csv", methods=["GET"])
 def api_export_csv():
-    import io
-    import csv
-    import sqlite3
-    from flask import send_file
+    """Stream attendance as CSV, XLSX or Parquet for one date (date=) or a range (from=/to=).
+
+    Rows come from the Parquet archive for archived days and from the DB otherwise.
+    """
+    from flask import Response, send_file, stream_with_context
+    from attendance_archive import iter_rows, write_parquet
+    from attendance_export import iter_csv, write_xlsx
 
     date_str = request.args.get("date")
+    date_from = request.args.get("from") or date_str
+    date_to = request.args.get("to") or date_str
     fmt = request.args.get("format", "csv")
-    ensure_db(DB_PATH)
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    if date_str:
-        cur.execute(
-            "SELECT id, name, date, time FROM attendance WHERE date = ?", (date_str,)
-        )
+    invalid = _invalid_date(date_from, date_to)
+    if invalid:
+        return invalid
+    if date_from and date_to and date_from == date_to:
+        label = date_from
+    elif date_from or date_to:
+        label = f"{date_from or 'start'}_{date_to or 'end'}"
     else:
-        cur.execute("SELECT id, name, date, time FROM attendance")
-    rows = cur.fetchall()
-    conn.close()
+        label = "all"
+    if fmt == "parquet":
+        try:
+            output = write_parquet(DB_PATH, ARCHIVE_DIR, date_from, date_to)
+        except ImportError:
+            return jsonify({"error": "pandas and pyarrow required for parquet export"}), 500
+        return send_file(
+            output,
+            mimetype="application/vnd.apache.parquet",
+            as_attachment=True,
+            download_name=f"attendance_{label}.parquet",
+        )
+    rows = iter_rows(DB_PATH, ARCHIVE_DIR, date_from, date_to)
 
     if fmt == "excel" or fmt == "xlsx":
         try:
-            import pandas as pd
-        except Exception:
-            return jsonify({"error": "pandas required for excel export"}), 500
-        df = pd.DataFrame(rows, columns=["id", "name", "date", "time"])
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine="openpyxl") as writer:
-            df.to_excel(writer, index=False, sheet_name="attendance")
-        output.seek(0)
+            output = write_xlsx(rows)
+        except ImportError:
+            return jsonify({"error": "openpyxl required for excel export"}), 500
         return send_file(
             output,
             mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             as_attachment=True,
-            download_name=f"attendance_{date_str or 'all'}.xlsx",
+            download_name=f"attendance_{label}.xlsx",
         )
     else:
-        # CSV
-        output = io.StringIO()
-        w = csv.writer(output)
-        w.writerow(["id", "name", "date", "time"])
-        for r in rows:
-            w.writerow(r)
-        output.seek(0)
-        return send_file(
-            io.BytesIO(output.getvalue().encode("utf-8")),
+        # CSV, sent with chunked transfer encoding as rows are read
+        return Response(
+            stream_with_context(iter_csv(rows)),
             mimetype="text/csv",
-            as_attachment=True,
-            download_name=f"attendance_{date_str or 'all'}.csv",
+            headers={
+                "Content-Disposition": f"attachment; filename=attendance_{label}.csv"
+            },
         )
+
+
+@app.route("/api/recognize", methods=["POST"])
+def api_recognize():
+    """Recognize faces in one or many images and mark attendance for matches.
+
+    Accepts multipart uploads (any number of file fields) or a JSON batch:
+    {"images": [{"name": "...", "data": "<base64>"}, ...] or ["<base64>", ...],
+     "threshold": 70, "mark": true}
+    """
+    import base64
+    import binascii
+
+    try:
+        from model_registry import get_model
+        from recognition import recognize_batch
+        from result_cache import get_result_cache
+        from attendance_writer import get_writer
+    except Exception as e:
+        return jsonify({"error": f"Missing imaging dependencies: {e}"}), 500
+
+    images = []
+    if request.files:
+        for field, f in request.files.items(multi=True):
+            images.append((f.filename or field, f.read()))
+        opts = request.form
+    else:
+        body = request.get_json(silent=True) or {}
+        for i, item in enumerate(body.get("images") or []):
+            if isinstance(item, dict):
+                name, data = item.get("name") or str(i), item.get("data", "")
+            else:
+                name, data = str(i), item
+            try:
+                images.append((name, base64.b64decode(data, validate=True)))
+            except (binascii.Error, TypeError, ValueError):
+                return jsonify({"error": f"Image {name} is not valid base64"}), 400
+        opts = body
+    if not images:
+        return jsonify({"error": "No images provided"}), 400
+    if len(images) > RECOGNIZE_MAX_IMAGES:
+        return (
+            jsonify({"error": f"At most {RECOGNIZE_MAX_IMAGES} images per request"}),
+            400,
+        )
+    try:
+        threshold = float(opts.get("threshold", 70))
+    except (TypeError, ValueError):
+        return jsonify({"error": "threshold must be a number"}), 400
+    mark = str(opts.get("mark", "true")).lower() in ("1", "true", "yes")
+
+    try:
+        model = get_model(MODEL_DIR)
+    except Exception as e:
+        return jsonify({"error": f"Model not available: {e}"}), 503
+
+    # repeated uploads of the same image are answered from the result cache
+    results = recognize_batch(model, images, threshold, cache=get_result_cache())
+    if mark:
+        writer = get_writer(DB_PATH)
+        for entry in results:
+            for face in entry.get("faces", []):
+                if face["recognized"]:
+                    face["marked"] = writer.mark(face["id"], face["name"])
+        if not writer.flush():
+            return jsonify({"error": f"Attendance could not be saved: {writer.last_error}"}), 500
+    return jsonify({"results": results})
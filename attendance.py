@@ -1,79 +1,195 @@
-import os
 import cv2
 import argparse
-from utils import load_labels, mark_attendance_db
-import pickle
-from pathlib import Path
+from attendance_writer import get_writer
+from model_registry import get_model
+from face_utils import normalize_face, detect_faces, detection_scale
+from face_tracker import FaceTracker
+from lbph_model import predict_many
+from live_metrics import LiveMetrics
 import datetime
 
-# constants
-CASCADE_PATH = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
 
+def identify_faces(gray, faces, recognizer, threshold, tracker=None):
+    """
+    Predict labels for detected faces. Returns [(box, label_id, confidence, confirmed_now)]
+    for recognized faces only. Without a tracker every face is predicted and
+    confirmed_now is always True; with one, confirmed tracks are reported without
+    calling predict again and confirmed_now is True only on the confirming frame.
+    The faces that need a prediction are predicted together (one batch for a
+    binary model).
+    """
+    results = []
+    tracks = tracker.update(faces) if tracker is not None else [None] * len(faces)
+    boxes = [(int(x), int(y), int(w), int(h)) for (x, y, w, h) in faces]
+    pending = [i for i, track in enumerate(tracks) if track is None or not track.confirmed]
+    crops = [normalize_face(gray[y : y + h, x : x + w]) for (x, y, w, h) in (boxes[i] for i in pending)]
+    preds = dict(zip(pending, predict_many(recognizer, crops)))
+    for i, (box, track) in enumerate(zip(boxes, tracks)):
+        if i not in preds:
+            results.append((box, track.label, track.confidence, False))
+            continue
+        if preds[i] is None:
+            # In case of error from model, skip this face
+            continue
+        label_id, confidence = preds[i]
+        recognized = label_id is not None and confidence < threshold
+        if track is None:
+            if recognized:
+                results.append((box, label_id, confidence, True))
+        elif tracker.observe(track, label_id if recognized else None, confidence):
+            results.append((box, track.label, track.confidence, True))
+    return results
 
-def load_recognizer(model_dir="model"):
-    trainer_path = os.path.join(model_dir, "trainer.yml")
-    if not os.path.exists(trainer_path):
-        raise RuntimeError(f"No trainer found at {trainer_path}. Run train.py first.")
-    try:
-        recognizer = cv2.face.LBPHFaceRecognizer_create()
-    except AttributeError:
-        raise RuntimeError("cv2.face not found. Install opencv-contrib-python.")
-    recognizer.read(trainer_path)
-    return recognizer
 
+def draw_frame_stats(frame, scale, n_faces, fps=None):
+    text = f"detect scale {scale:.2f} | faces {n_faces}"
+    if fps is not None:
+        text += f" | {fps:.1f} fps"
+    cv2.putText(frame, text, (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 1)
 
-def run_live(
-    model_dir="model", db_path="attendance.db", cam_index=0, confidence_threshold=70
+
+def draw_faces(frame, identified, labels_map):
+    """Box and "name (confidence)" for each identify_faces result."""
+    color = (0, 255, 0)
+    for (x, y, w, h), label_id, confidence, _ in identified:
+        name = labels_map.get(label_id, f"ID_{label_id}")
+        cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
+        cv2.putText(
+            frame, f"{name} ({round(confidence, 1)})", (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2
+        )
+
+
+def camera_scale(frame, detect_width, metrics, source):
+    """Detection scale for a camera, chosen from its first frame, printed and recorded in metrics."""
+    scale = detection_scale(frame.shape[1], detect_width)
+    print(f"[*] Camera {source}: {frame.shape[1]}x{frame.shape[0]}, detection scale {scale:.2f}")
+    metrics.set_detection(frame.shape[1], frame.shape[0], scale)
+    return scale
+
+
+def writer_mark(writer):
+    """mark callback for process_frame: writes through an AttendanceWriter and prints new marks."""
+
+    def mark(label_id, name):
+        inserted = writer.mark(label_id, name)
+        if inserted:
+            print(
+                f"[+] Attendance marked for {name} at {datetime.datetime.now().strftime('%H:%M:%S')}"
+            )
+        return inserted
+
+    return mark
+
+
+def process_frame(
+    frame,
+    model,
+    scale,
+    threshold,
+    metrics,
+    tracker=None,
+    mark=None,
+    detector=None,
+    draw=True,
 ):
-    labels_path = os.path.join(model_dir, "labels.pickle")
-    if not os.path.exists(labels_path):
-        raise RuntimeError(
-            f"No labels file found at {labels_path}. Run train.py first."
+    """
+    The per-frame work shared by the live loops: cvtColor, detect (with
+    ``detector``, default the model's), identify, call ``mark(label_id, name)``
+    for every face confirmed on this frame, and with ``draw`` annotate frame
+    with the faces and frame stats. Each step is timed in metrics and the frame
+    is counted. Returns (detected faces, identify_faces results).
+    """
+    with metrics.stage("cvtColor"):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    with metrics.stage("detect"):
+        faces = detect_faces(
+            detector or model.detector, gray, scale, scaleFactor=1.1, minNeighbors=5, minSize=(60, 60)
         )
-    with open(labels_path, "rb") as f:
-        labels_map = pickle.load(f)  # id -> name
+    with metrics.stage("predict"):
+        identified = identify_faces(gray, faces, model.recognizer, threshold, tracker)
+    if mark is not None:
+        for _, label_id, _, confirmed_now in identified:
+            # tracked faces are marked once, on the frame their identity is confirmed
+            if confirmed_now:
+                with metrics.stage("db_write"):
+                    mark(label_id, model.labels_map.get(label_id, f"ID_{label_id}"))
+    metrics.frame_done()
+    if draw:
+        draw_faces(frame, identified, model.labels_map)
+        draw_frame_stats(frame, scale, len(faces), metrics.fps())
+    return faces, identified
+
+
+def run_live(
+    model_dir="model",
+    db_path="attendance.db",
+    cam_index=0,
+    confidence_threshold=70,
+    track=True,
+    pipelined=False,
+    workers=2,
+    detect_width=None,
+    headless=False,
+    metrics_interval=10.0,
+    metrics_jsonl=None,
+    max_latency=0.5,
+):
+    metrics = LiveMetrics(cam_index, report_interval=metrics_interval, jsonl_path=metrics_jsonl)
+    if pipelined:
+        from live_pipeline import run_pipelined
 
-    recognizer = load_recognizer(model_dir)
-    detector = cv2.CascadeClassifier(CASCADE_PATH)
+        return run_pipelined(
+            model_dir,
+            db_path,
+            cam_index,
+            confidence_threshold,
+            workers=workers,
+            max_latency=max_latency,
+            detect_width=detect_width,
+            headless=headless,
+            metrics=metrics,
+        )
+    # warm recognizer/labels/detector from the shared registry; raises if not trained
+    get_model(model_dir)
+    writer = get_writer(db_path)
+    mark = writer_mark(writer)
+    tracker = FaceTracker() if track else None
     cap = cv2.VideoCapture(cam_index)
     if not cap.isOpened():
         raise RuntimeError(f"Cannot open camera {cam_index}")
 
-    print("[*] Starting camera. Press 'q' to quit.")
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print("[!] Failed to read frame from camera.")
-            break
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = detector.detectMultiScale(
-            gray, scaleFactor=1.1, minNeighbors=5, minSize=(60, 60)
-        )
-        for x, y, w, h in faces:
-            face_crop_gray = gray[y : y + h, x : x + w]
-            try:
-                label_id, confidence = recognizer.predict(face_crop_gray)
-            except Exception:
-                # In case of error from model, skip this face
+    if headless:
+        print("[*] Starting camera (headless). Press Ctrl+C to quit.")
+    else:
+        print("[*] Starting camera. Press 'q' to quit.")
+    scale = None
+    try:
+        while True:
+            with metrics.stage("read"):
+                ret, frame = cap.read()
+            if not ret:
+                print("[!] Failed to read frame from camera.")
+                break
+            # picks up a retrained model without restarting the camera loop
+            model = get_model(model_dir)
+            if scale is None:
+                scale = camera_scale(frame, detect_width, metrics, cam_index)
+            process_frame(
+                frame, model, scale, confidence_threshold, metrics, tracker, mark, draw=not headless
+            )
+            if headless:
                 continue
-            if label_id is not None and confidence < confidence_threshold:
-                name = labels_map.get(label_id, f"ID_{label_id}")
-                inserted = mark_attendance_db(label_id, name, db_path)
-                text = f"{name} ({round(confidence, 1)})"
-                color = (0, 255, 0)
-                if inserted:
-                    print(
-                        f"[+] Attendance marked for {name} at {datetime.datetime.now().strftime('%H:%M:%S')}"
-                    )
-                cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
-                cv2.putText(
-                    frame, text, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2
-                )
-        cv2.imshow("Attendance", frame)
-        if cv2.waitKey(1) & 0xFF == ord("q"):
-            break
-    cap.release()
-    cv2.destroyAllWindows()
+            cv2.imshow("Attendance", frame)
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cap.release()
+        writer.flush()
+        metrics.maybe_report(force=True)
+        if not headless:
+            cv2.destroyAllWindows()
 
 
 if __name__ == "__main__":
@@ -91,5 +207,62 @@ if __name__ == "__main__":
         type=float,
         help="Confidence threshold (lower = stricter)",
     )
+    parser.add_argument(
+        "--no-track",
+        action="store_true",
+        help="Predict every face on every frame instead of tracking confirmed faces",
+    )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="Run capture, recognition and display/DB writes as separate pipeline stages",
+    )
+    parser.add_argument(
+        "--workers",
+        default=2,
+        type=int,
+        help="Detection/recognition threads in --pipelined mode",
+    )
+    parser.add_argument(
+        "--max-latency",
+        default=0.5,
+        type=float,
+        help="In --pipelined mode, results older than this many seconds are not drawn (they are still marked)",
+    )
+    parser.add_argument(
+        "--detect-width",
+        default=None,
+        type=int,
+        help="Run face detection on a copy downscaled to this width (default: full resolution)",
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="Do not open a preview window (for machines without a display)",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        default=10.0,
+        type=float,
+        help="Seconds between per-stage latency/FPS reports",
+    )
+    parser.add_argument(
+        "--metrics-jsonl",
+        default=None,
+        help="Append each metrics report to this file as a JSON line",
+    )
     args = parser.parse_args()
-    run_live(args.model_dir, args.db, args.cam, args.threshold)
+    run_live(
+        args.model_dir,
+        args.db,
+        args.cam,
+        args.threshold,
+        not args.no_track,
+        args.pipelined,
+        args.workers,
+        args.detect_width,
+        args.headless,
+        args.metrics_interval,
+        args.metrics_jsonl,
+        args.max_latency,
+    )
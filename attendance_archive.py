@@ -0,0 +1,222 @@
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import tempfile
+
+from attendance_export import COLUMNS, iter_attendance_rows
+from utils import ensure_db, resolve_db_path
+
+ARCHIVE_DIR = "archive"
+STATE_FILE = "_archive.json"
+BATCH_ROWS = 10000
+
+
+def _next_day(date_str):
+    return (datetime.date.fromisoformat(date_str) + datetime.timedelta(days=1)).isoformat()
+
+
+def _prev_day(date_str):
+    return (datetime.date.fromisoformat(date_str) - datetime.timedelta(days=1)).isoformat()
+
+
+def archived_through(archive_dir=ARCHIVE_DIR):
+    """Last date (YYYY-MM-DD, inclusive) held in the archive, or None if there is no archive."""
+    path = os.path.join(archive_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f).get("through")
+
+
+def _save_state(archive_dir, through):
+    path = os.path.join(archive_dir, STATE_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"through": through}, f)
+    os.replace(tmp, path)
+
+
+def _month_path(archive_dir, month):
+    # hive-style partition directory, so readers can prune months by path
+    return os.path.join(archive_dir, f"month={month}", "attendance.parquet")
+
+
+def _frame(rows):
+    import pandas as pd
+
+    df = pd.DataFrame(rows, columns=COLUMNS)
+    return df.astype({"id": "int64", "name": "string", "date": "string", "time": "string"})
+
+
+def archive_attendance(
+    db_path="attendance.db",
+    archive_dir=ARCHIVE_DIR,
+    cutoff=None,
+    closed_months=False,
+):
+    """
+    Copy attendance for closed days (before ``cutoff``, default today; with
+    closed_months, before the first of this month) into monthly Parquet files
+    ``<archive_dir>/month=YYYY-MM/attendance.parquet``. Only days after the
+    previous run's watermark are read; a month file that already exists is
+    rewritten with the new days appended. SQLite keeps every row: the live
+    readers (/api/attendance, summaries, absent students) query it alone.
+    Returns the number of rows archived.
+    """
+    import pandas as pd
+
+    db_path = resolve_db_path(db_path)
+    ensure_db(db_path)
+    if cutoff is None:
+        today = datetime.date.today()
+        cutoff = (today.replace(day=1) if closed_months else today).isoformat()
+    previous = archived_through(archive_dir)
+    start = _next_day(previous) if previous else None
+    if start is not None and start >= cutoff:
+        print(f"[*] Archive already holds everything before {cutoff}")
+        return 0
+    through = _prev_day(cutoff)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        sql = "SELECT DISTINCT substr(date, 1, 7) FROM attendance WHERE date < ?"
+        params = [cutoff]
+        if start:
+            sql += " AND date >= ?"
+            params.append(start)
+        months = [r[0] for r in conn.execute(sql + " ORDER BY 1", params)]
+    finally:
+        conn.close()
+
+    total = 0
+    for month in months:
+        lo = max(start or "", f"{month}-01")
+        hi = min(through, f"{month}-31")
+        new = _frame(list(iter_attendance_rows(db_path, lo, hi)))
+        path = _month_path(archive_dir, month)
+        if os.path.exists(path):
+            old = pd.read_parquet(path)
+            new_rows = len(new)
+            new = pd.concat([old, new], ignore_index=True)
+        else:
+            new_rows = len(new)
+        new = new.drop_duplicates(["id", "date"]).sort_values(["date", "time"], kind="stable")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(fd)
+        new.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+        total += new_rows
+        print(f"[+] Archived {new_rows} row(s) for {month} -> {path}")
+
+    # the watermark moves only once every month file is in place
+    os.makedirs(archive_dir, exist_ok=True)
+    _save_state(archive_dir, through)
+    print(f"[*] Archive complete through {through}: {total} new row(s)")
+    return total
+
+
+def iter_batches(
+    db_path="attendance.db",
+    archive_dir=ARCHIVE_DIR,
+    date_from=None,
+    date_to=None,
+    batch_rows=BATCH_ROWS,
+):
+    """
+    Yield DataFrames of attendance with date_from <= date <= date_to, in date
+    order: archived days from the Parquet months that overlap the range, then
+    days after the archive watermark from the live DB.
+    """
+    import pyarrow.parquet as pq
+
+    through = archived_through(archive_dir)
+    if through and (date_from is None or date_from <= through):
+        hi = min(date_to, through) if date_to else through
+        months = sorted(
+            d[len("month="):]
+            for d in os.listdir(archive_dir)
+            if d.startswith("month=")
+            and (date_from is None or d[len("month="):] >= date_from[:7])
+            and d[len("month="):] <= hi[:7]
+        )
+        for month in months:
+            table = pq.read_table(
+                _month_path(archive_dir, month),
+                filters=[("date", ">=", date_from or ""), ("date", "<=", hi)],
+            )
+            for batch in table.to_batches(max_chunksize=batch_rows):
+                if batch.num_rows:
+                    yield batch.to_pandas()
+    live_from = date_from
+    if through and (live_from is None or live_from <= through):
+        live_from = _next_day(through)
+    if date_to and live_from and live_from > date_to:
+        return
+    rows = []
+    for row in iter_attendance_rows(db_path, live_from, date_to):
+        rows.append(row)
+        if len(rows) >= batch_rows:
+            yield _frame(rows)
+            rows = []
+    if rows:
+        yield _frame(rows)
+
+
+def iter_rows(db_path="attendance.db", archive_dir=ARCHIVE_DIR, date_from=None, date_to=None):
+    """(id, name, date, time) tuples from the archive plus the live DB; the DB alone if there is no archive."""
+    if archived_through(archive_dir) is None:
+        yield from iter_attendance_rows(db_path, date_from, date_to)
+        return
+    for df in iter_batches(db_path, archive_dir, date_from, date_to):
+        yield from df[COLUMNS].itertuples(index=False, name=None)
+
+
+def read_attendance(db_path="attendance.db", archive_dir=ARCHIVE_DIR, date_from=None, date_to=None):
+    """All attendance in the range as one DataFrame (archive plus live DB), for reports."""
+    import pandas as pd
+
+    frames = list(iter_batches(db_path, archive_dir, date_from, date_to))
+    if not frames:
+        return _frame([])
+    return pd.concat(frames, ignore_index=True)
+
+
+def write_parquet(db_path="attendance.db", archive_dir=ARCHIVE_DIR, date_from=None, date_to=None):
+    """Write the range to a Parquet file batch by batch. Returns an open temporary file at position 0."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    out = tempfile.TemporaryFile(suffix=".parquet")
+    schema = pa.Schema.from_pandas(_frame([]), preserve_index=False)
+    with pq.ParquetWriter(out, schema) as writer:
+        for df in iter_batches(db_path, archive_dir, date_from, date_to):
+            writer.write_table(pa.Table.from_pandas(df[COLUMNS], schema=schema, preserve_index=False))
+    out.seek(0)
+    return out
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Archive closed days of attendance to monthly Parquet files"
+    )
+    parser.add_argument("--db", default="attendance.db", help="Path to SQLite DB")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR, help="Parquet archive directory")
+    parser.add_argument(
+        "--before",
+        default=None,
+        help="Archive days before this date (YYYY-MM-DD, default today)",
+    )
+    parser.add_argument(
+        "--closed-months",
+        action="store_true",
+        help="Only archive complete months (before the first of this month)",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    archive_attendance(args.db, args.archive_dir, args.before, args.closed_months)
@@ -0,0 +1,75 @@
+import csv
+import io
+import sqlite3
+import tempfile
+
+from utils import ensure_db, resolve_db_path
+
+COLUMNS = ["id", "name", "date", "time"]
+FETCH_SIZE = 1000
+# CSV text is yielded once this many characters have been buffered
+CSV_CHUNK_CHARS = 64 * 1024
+
+
+def iter_attendance_rows(db_path="attendance.db", date_from=None, date_to=None, fetch_size=FETCH_SIZE):
+    """
+    Yield (id, name, date, time) rows with date_from <= date <= date_to (either
+    bound optional), ordered by date and time, fetching ``fetch_size`` rows at a time.
+    """
+    db_path = resolve_db_path(db_path)
+    ensure_db(db_path)
+    where, params = [], []
+    if date_from:
+        where.append("date >= ?")
+        params.append(date_from)
+    if date_to:
+        where.append("date <= ?")
+        params.append(date_to)
+    sql = "SELECT id, name, date, time FROM attendance"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY date, time"
+    conn = sqlite3.connect(db_path)
+    try:
+        cur = conn.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+
+def iter_csv(rows, header=COLUMNS):
+    """Encode rows as CSV, yielding UTF-8 chunks of roughly CSV_CHUNK_CHARS."""
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(header)
+    for r in rows:
+        w.writerow(r)
+        if buf.tell() >= CSV_CHUNK_CHARS:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def write_xlsx(rows, header=COLUMNS, sheet_name="attendance"):
+    """
+    Write rows to an .xlsx with a write-only openpyxl workbook, which streams rows
+    to disk instead of keeping every cell in memory. Returns an open temporary
+    file positioned at the start; it is deleted when closed.
+    """
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+    ws.append(header)
+    for r in rows:
+        ws.append(list(r))
+    out = tempfile.TemporaryFile(suffix=".xlsx")
+    wb.save(out)
+    out.seek(0)
+    return out
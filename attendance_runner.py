@@ -1,61 +1,96 @@
 import cv2
-import os
-import pickle
-from pathlib import Path
-from utils import mark_attendance_db, load_labels
+from attendance_writer import get_writer
+from model_registry import get_model
+from face_tracker import FaceTracker
+from attendance import camera_scale, process_frame
+from live_metrics import LiveMetrics
 import argparse
 
 
-CASCADE_PATH = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
 MODEL_DIR = "model"
 
 
-def run(cam_index=0, model_dir=MODEL_DIR, threshold=70):
-    labels_path = os.path.join(model_dir, "labels.pickle")
-    trainer_path = os.path.join(model_dir, "trainer.yml")
-    if not os.path.exists(trainer_path):
-        raise RuntimeError("No trained model found. Run train.py first.")
-    with open(labels_path, "rb") as f:
-        labels_map = pickle.load(f)
-    recognizer = cv2.face.LBPHFaceRecognizer_create()
-    recognizer.read(trainer_path)
-    detector = cv2.CascadeClassifier(CASCADE_PATH)
+def run(
+    cam_index=0,
+    model_dir=MODEL_DIR,
+    threshold=70,
+    track=True,
+    detect_width=None,
+    headless=False,
+    metrics_interval=10.0,
+    metrics_jsonl=None,
+):
+    get_model(model_dir)
+    writer = get_writer("attendance.db")
+    tracker = FaceTracker() if track else None
+    metrics = LiveMetrics(cam_index, report_interval=metrics_interval, jsonl_path=metrics_jsonl)
     cap = cv2.VideoCapture(cam_index)
-    print("[*] Starting camera. Press 'q' to quit.")
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = detector.detectMultiScale(
-            gray, scaleFactor=1.1, minNeighbors=5, minSize=(60, 60)
-        )
-        for x, y, w, h in faces:
-            face_gray = gray[y : y + h, x : x + w]
-            try:
-                label_id, conf = recognizer.predict(face_gray)
-            except Exception:
-                # Skip faces that cause prediction errors
+    print("[*] Starting camera. Press " + ("Ctrl+C" if headless else "'q'") + " to quit.")
+    scale = None
+    try:
+        while True:
+            with metrics.stage("read"):
+                ret, frame = cap.read()
+            if not ret:
+                break
+            model = get_model(model_dir)
+            if scale is None:
+                scale = camera_scale(frame, detect_width, metrics, cam_index)
+            process_frame(
+                frame, model, scale, threshold, metrics, tracker, writer.mark, draw=not headless
+            )
+            if headless:
                 continue
-            if label_id is not None and conf < threshold:
-                name = labels_map.get(label_id, f"ID_{label_id}")
-                mark_attendance_db(label_id, name)
-                color = (0, 255, 0)
-                text = f"{name} ({round(conf, 1)})"
-                cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
-                cv2.putText(
-                    frame, text, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2
-                )
-        cv2.imshow("Attendance", frame)
-        if cv2.waitKey(1) & 0xFF == ord("q"):
-            break
-    cap.release()
-    cv2.destroyAllWindows()
+            cv2.imshow("Attendance", frame)
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cap.release()
+        writer.flush()
+        metrics.maybe_report(force=True)
+        if not headless:
+            cv2.destroyAllWindows()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--cam", type=int, default=0)
+    parser.add_argument(
+        "--cams",
+        nargs="+",
+        default=None,
+        help="Several camera indices or video sources, each run in its own process",
+    )
     parser.add_argument("--threshold", type=float, default=70.0)
+    parser.add_argument("--no-track", action="store_true")
+    parser.add_argument("--detect-width", type=int, default=None)
+    parser.add_argument("--headless", action="store_true", help="No preview window")
+    parser.add_argument("--metrics-interval", type=float, default=10.0)
+    parser.add_argument("--metrics-jsonl", default=None)
     args = parser.parse_args()
-    run(args.cam, threshold=args.threshold)
+    if args.cams:
+        from multi_camera import run_multi
+
+        run_multi(
+            args.cams,
+            MODEL_DIR,
+            "attendance.db",
+            args.threshold,
+            detect_width=args.detect_width,
+            track=not args.no_track,
+            headless=args.headless,
+            metrics_interval=args.metrics_interval,
+            metrics_jsonl=args.metrics_jsonl,
+        )
+        raise SystemExit(0)
+    run(
+        args.cam,
+        threshold=args.threshold,
+        track=not args.no_track,
+        detect_width=args.detect_width,
+        headless=args.headless,
+        metrics_interval=args.metrics_interval,
+        metrics_jsonl=args.metrics_jsonl,
+    )
@@ -0,0 +1,181 @@
+import atexit
+import datetime
+import queue
+import sqlite3
+import threading
+from datetime import date
+
+from utils import ensure_db, resolve_db_path
+
+_STOP = object()
+
+
+class _Flush:
+    """A flush request: set once the rows queued before it were written; error holds any failure."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+class AttendanceWriter:
+    """Write-behind attendance writer for one SQLite database.
+
+    ``mark`` answers "newly inserted or already present" from an in-memory set
+    of ids seen today (seeded from the DB once per date) and queues new rows.
+    A background thread owns a single WAL-mode connection and flushes queued
+    rows with ``executemany`` in one transaction every ``flush_interval``
+    seconds or as soon as ``batch_size`` rows are waiting. A failed write is
+    kept in ``last_error`` and makes the next ``flush`` return False.
+    """
+
+    def __init__(self, db_path="attendance.db", flush_interval=0.5, batch_size=100):
+        self.db_path = resolve_db_path(db_path)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        ensure_db(self.db_path)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._seen_date = None
+        self._seen = set()
+        self._closed = False
+        self.last_error = None
+        self._thread = threading.Thread(
+            target=self._run, name="attendance-writer", daemon=True
+        )
+        self._thread.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _seen_for(self, day):
+        # caller holds self._lock
+        if self._seen_date != day:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                rows = conn.execute(
+                    "SELECT id FROM attendance WHERE date = ?", (day,)
+                ).fetchall()
+            finally:
+                conn.close()
+            self._seen_date = day
+            self._seen = {r[0] for r in rows}
+        return self._seen
+
+    def mark(self, id_val: int, name: str) -> bool:
+        """Queue attendance for today. Returns True if newly marked, False if already present."""
+        today = date.today().isoformat()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("AttendanceWriter is closed")
+            seen = self._seen_for(today)
+            if id_val in seen:
+                return False
+            seen.add(id_val)
+        now = datetime.datetime.now().strftime("%H:%M:%S")
+        self._queue.put((id_val, name, today, now))
+        return True
+
+    def flush(self, timeout=None):
+        """
+        Block until every row queued so far has been written. Returns True if
+        they were all committed, False on timeout or if a write failed since
+        the previous flush (see last_error).
+        """
+        waiter = _Flush()
+        self._queue.put(waiter)
+        if not waiter.done.wait(timeout):
+            return False
+        return waiter.error is None
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _write(self, conn, batch):
+        # the unique (id, date) index drops rows already written by other processes
+        conn.executemany(
+            "INSERT OR IGNORE INTO attendance (id, name, date, time) VALUES (?, ?, ?, ?)",
+            batch,
+        )
+        conn.commit()
+        print(f"[writer] committed {len(batch)} attendance row(s) (db={self.db_path})")
+
+    def _run(self):
+        conn = self._connect()
+        batch = []
+        waiters = []
+        # first failed write since waiters were last released
+        error = None
+        stop = False
+        while not stop:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+            # drain whatever else is already waiting, up to batch_size rows
+            while item is not None:
+                if item is _STOP:
+                    stop = True
+                elif isinstance(item, _Flush):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                if stop or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    item = None
+            if batch:
+                try:
+                    self._write(conn, batch)
+                except sqlite3.Error as e:
+                    conn.rollback()
+                    print(f"[!] Failed to write {len(batch)} attendance row(s): {e}")
+                    self.last_error = error = error or e
+                    # forget the failed ids so a later sighting queues them again
+                    with self._lock:
+                        for i, _, d, _ in batch:
+                            if d == self._seen_date:
+                                self._seen.discard(i)
+                batch = []
+            if waiters:
+                for w in waiters:
+                    w.error = error
+                    w.done.set()
+                waiters = []
+                error = None
+        conn.close()
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(db_path="attendance.db"):
+    """Return the shared AttendanceWriter for db_path, starting it on first use."""
+    key = resolve_db_path(db_path)
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = AttendanceWriter(key)
+            _writers[key] = writer
+        return writer
+
+
+@atexit.register
+def close_all():
+    """Flush and stop every shared writer (runs automatically at interpreter exit)."""
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for w in writers:
+        w.close()
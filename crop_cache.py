@@ -0,0 +1,47 @@
+import os
+import uuid
+
+import numpy as np
+
+from face_utils import FACE_SIZE
+
+
+class CropCache:
+    """Persistent store of normalized face crops keyed by source image content hash.
+
+    Each source image maps to one ``.npy`` file holding a uint8 array of shape
+    (n_faces, height, width). Files are loaded memory-mapped, so retraining
+    reads crops straight from the page cache without decoding or detecting again.
+    The cache directory is namespaced by crop size so changing FACE_SIZE never
+    mixes incompatible crops.
+    """
+
+    def __init__(self, cache_dir, size=FACE_SIZE):
+        self.size = size
+        self.cache_dir = os.path.join(cache_dir, f"{size[0]}x{size[1]}")
+
+    def _path(self, digest):
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}.npy")
+
+    def get(self, digest):
+        """Return the memory-mapped crop array for digest, or None on a miss."""
+        path = self._path(digest)
+        if not os.path.exists(path):
+            return None
+        try:
+            return np.load(path, mmap_mode="r")
+        except (ValueError, OSError):
+            # truncated or corrupt entry: treat as a miss, it will be rewritten
+            return None
+
+    def put(self, digest, crops):
+        """Store the normalized crops for digest and return them as one array."""
+        arr = np.asarray(crops, dtype=np.uint8).reshape(-1, self.size[1], self.size[0])
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a unique temp file then rename, so concurrent workers never see partial files
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, arr)
+        os.replace(tmp_path, path)
+        return arr
@@ -0,0 +1,375 @@
+import datetime
+import json
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from mailer import MailSender
+from utils import absent_notice, absent_students, ensure_db, resolve_db_path
+
+# a claimed message not finished within this many seconds (worker crashed) is claimable again
+CLAIM_LEASE = 600.0
+# SMTP settings never written to email_jobs.smtp; they stay in this process's memory
+SECRET_KEYS = ("pass",)
+
+# job id -> secret SMTP settings given with the request, until the job finishes
+_job_secrets = {}
+_job_secrets_lock = threading.Lock()
+
+
+def _connect(db_path):
+    db_path = resolve_db_path(db_path)
+    ensure_db(db_path)
+    return sqlite3.connect(db_path, timeout=30, isolation_level=None)
+
+
+def _now_iso():
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+def enqueue_absent_emails(
+    db_path="attendance.db",
+    csv_path="students.csv",
+    date_str=None,
+    smtp_config=None,
+    kind="manual",
+):
+    """
+    Queue an absent notice for every absentee with an email on date_str (defaults
+    to today). Returns (job_id, queued message count). A "daily" job is created at
+    most once per date; a repeat returns the existing job with a count of 0.
+    smtp_config, if given, overrides the worker's settings for this job. Only its
+    non-secret fields are stored in the DB (cleared once the job finishes); the
+    password is kept in memory for this process's worker. If the process
+    restarts first, the worker's own password (SMTP_PASS) is used.
+    """
+    if date_str is None:
+        date_str = datetime.date.today().isoformat()
+    try:
+        datetime.date.fromisoformat(date_str)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid date: {date_str}")
+    absent = [s for s in absent_students(csv_path, db_path, date_str) if s["email"]]
+    stored = secrets = None
+    if smtp_config:
+        stored = {k: v for k, v in smtp_config.items() if k not in SECRET_KEYS}
+        secrets = {k: smtp_config[k] for k in SECRET_KEYS if smtp_config.get(k)}
+    conn = _connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO email_jobs (kind, date, smtp, created_at) VALUES (?, ?, ?, ?)",
+                (kind, date_str, json.dumps(stored) if stored else None, _now_iso()),
+            )
+            if cur.rowcount == 0:
+                job_id = conn.execute(
+                    "SELECT id FROM email_jobs WHERE kind = ? AND date = ?", (kind, date_str)
+                ).fetchone()[0]
+                conn.execute("COMMIT")
+                return job_id, 0
+            job_id = cur.lastrowid
+            rows = []
+            for s in absent:
+                subject, body = absent_notice(s["name"], date_str)
+                rows.append((job_id, s["id"], s["email"], subject, body))
+            conn.executemany(
+                "INSERT INTO email_outbox (job_id, student_id, to_email, subject, body) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            if not rows:
+                conn.execute(
+                    "UPDATE email_jobs SET finished_at = ?, smtp = NULL WHERE id = ?",
+                    (_now_iso(), job_id),
+                )
+            elif secrets:
+                with _job_secrets_lock:
+                    _job_secrets[job_id] = secrets
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    print(f"[*] Queued email job {job_id}: {len(rows)} absent notice(s) for {date_str}")
+    return job_id, len(rows)
+
+
+def _job_dict(row, counts):
+    job_id, kind, date_str, created_at, finished_at = row
+    c = counts.get(job_id, {})
+    pending = c.get("pending", 0) + c.get("sending", 0)
+    done = c.get("sent", 0) + c.get("failed", 0)
+    if pending == 0:
+        status = "done"
+    elif done or c.get("sending", 0):
+        status = "running"
+    else:
+        status = "queued"
+    return {
+        "id": job_id,
+        "kind": kind,
+        "date": date_str,
+        "status": status,
+        "total": pending + done,
+        "pending": pending,
+        "sent": c.get("sent", 0),
+        "failed": c.get("failed", 0),
+        "created_at": created_at,
+        "finished_at": finished_at,
+    }
+
+
+def _job_counts(conn, job_ids):
+    counts = defaultdict(dict)
+    if not job_ids:
+        return counts
+    marks = ",".join("?" * len(job_ids))
+    for job_id, status, n in conn.execute(
+        f"SELECT job_id, status, COUNT(*) FROM email_outbox WHERE job_id IN ({marks}) GROUP BY job_id, status",
+        list(job_ids),
+    ):
+        counts[job_id][status] = n
+    return counts
+
+
+def get_job(db_path, job_id):
+    """Status of one job with its failed addresses, or None if there is no such job."""
+    conn = _connect(db_path)
+    try:
+        row = conn.execute(
+            "SELECT id, kind, date, created_at, finished_at FROM email_jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        job = _job_dict(row, _job_counts(conn, [job_id]))
+        job["failures"] = [
+            {"email": e, "error": err}
+            for e, err in conn.execute(
+                "SELECT to_email, last_error FROM email_outbox WHERE job_id = ? AND status = 'failed'",
+                (job_id,),
+            )
+        ]
+        return job
+    finally:
+        conn.close()
+
+
+def list_jobs(db_path, limit=20):
+    """Most recent jobs first."""
+    conn = _connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT id, kind, date, created_at, finished_at FROM email_jobs ORDER BY id DESC LIMIT ?",
+            (int(limit),),
+        ).fetchall()
+        counts = _job_counts(conn, [r[0] for r in rows])
+        return [_job_dict(r, counts) for r in rows]
+    finally:
+        conn.close()
+
+
+class OutboxWorker:
+    """Background thread that drains email_outbox in batches.
+
+    Each pass claims up to ``batch_size`` due messages (pending, or claimed by a
+    worker that did not finish within CLAIM_LEASE) in one write transaction, so
+    several processes can run a worker against the same DB. Claimed messages are
+    sent with mailer.MailSender; a failed message is retried on a later pass after
+    ``retry_delay`` * 2**(attempts - 1) seconds until it has had ``max_attempts``.
+    The worker polls every ``poll_interval`` seconds; ``wake()`` starts a pass now.
+    """
+
+    def __init__(
+        self,
+        db_path="attendance.db",
+        smtp_config=None,
+        batch_size=50,
+        poll_interval=5.0,
+        pool_size=4,
+        rate_limit=None,
+        max_attempts=3,
+        retry_delay=60.0,
+    ):
+        self.db_path = resolve_db_path(db_path)
+        self.smtp_config = smtp_config or {}
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.pool_size = pool_size
+        self.rate_limit = rate_limit
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="email-outbox", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=10.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                n = self.drain_once()
+            except Exception as e:
+                print(f"[!] Email outbox pass failed: {e}")
+                n = 0
+            if n == 0:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def _claim(self, conn):
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                """SELECT o.id, o.job_id, o.to_email, o.subject, o.body, o.attempts, j.smtp
+                   FROM email_outbox o JOIN email_jobs j ON j.id = o.job_id
+                   WHERE o.status IN ('pending', 'sending') AND o.available_at <= ?
+                   ORDER BY o.id LIMIT ?""",
+                (now, self.batch_size),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE email_outbox SET status = 'sending', attempts = attempts + 1, available_at = ? WHERE id = ?",
+                [(now + CLAIM_LEASE, r[0]) for r in rows],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def drain_once(self):
+        """Claim and send one batch. Returns the number of messages attempted."""
+        conn = _connect(self.db_path)
+        try:
+            rows = self._claim(conn)
+            if not rows:
+                return 0
+            # one MailSender per SMTP configuration in the batch
+            groups = defaultdict(list)
+            for row in rows:
+                groups[(row[6], row[1] if row[6] else None)].append(row)
+            results = []
+            for (smtp_json, job_id), group in groups.items():
+                smtp = self._job_smtp(job_id, smtp_json)
+                sender = MailSender(smtp, pool_size=self.pool_size, rate_limit=self.rate_limit)
+                sent, failed = sender.send_many([(r[2], r[3], r[4]) for r in group])
+                # addresses may repeat within a batch, so match results by count
+                by_email = defaultdict(list)
+                for r in group:
+                    by_email[r[2]].append(r)
+                for email in sent:
+                    results.append((by_email[email].pop(), None))
+                for email, err in failed:
+                    results.append((by_email[email].pop(), err))
+            self._record(conn, results)
+            return len(rows)
+        finally:
+            conn.close()
+
+    def _job_smtp(self, job_id, smtp_json):
+        """SMTP settings for a job: the stored overrides plus the secrets kept in memory, or the worker's own."""
+        if not smtp_json:
+            return self.smtp_config
+        smtp = json.loads(smtp_json)
+        with _job_secrets_lock:
+            secrets = _job_secrets.get(job_id)
+        if secrets is None:
+            secrets = {k: self.smtp_config[k] for k in SECRET_KEYS if self.smtp_config.get(k)}
+        smtp.update(secrets)
+        return smtp
+
+    def _record(self, conn, results):
+        now = time.time()
+        stamp = _now_iso()
+        updates = []
+        failed = 0
+        for (row_id, job_id, email, _, _, attempts, _), err in results:
+            attempts += 1
+            if err is None:
+                updates.append(("sent", now, None, stamp, row_id))
+            elif attempts < self.max_attempts:
+                delay = self.retry_delay * (2 ** (attempts - 1))
+                updates.append(("pending", now + delay, err, None, row_id))
+            else:
+                updates.append(("failed", now, err, None, row_id))
+                failed += 1
+                print(f"[!] Failed to send email to {email}: {err}")
+        job_ids = {r[0][1] for r in results}
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "UPDATE email_outbox SET status = ?, available_at = ?, last_error = ?, sent_at = ? WHERE id = ?",
+                updates,
+            )
+            # a job is finished once none of its messages are left to send
+            marks = ",".join("?" * len(job_ids))
+            conn.execute(
+                f"""UPDATE email_jobs SET finished_at = ?, smtp = NULL
+                    WHERE id IN ({marks}) AND finished_at IS NULL AND NOT EXISTS
+                    (SELECT 1 FROM email_outbox o WHERE o.job_id = email_jobs.id
+                     AND o.status IN ('pending', 'sending'))""",
+                [stamp, *job_ids],
+            )
+            finished = [
+                r[0]
+                for r in conn.execute(
+                    f"SELECT id FROM email_jobs WHERE id IN ({marks}) AND finished_at IS NOT NULL",
+                    list(job_ids),
+                )
+            ]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        with _job_secrets_lock:
+            for job_id in finished:
+                _job_secrets.pop(job_id, None)
+        sent = sum(1 for _, err in results if err is None)
+        print(f"[+] Email outbox: {sent} sent, {failed} failed")
+
+
+def start_scheduler(
+    db_path="attendance.db", csv_path="students.csv", at="17:00", worker=None
+):
+    """
+    Queue the day's absent notices every day at ``at`` (HH:MM, local time) with
+    APScheduler and wake ``worker`` to send them. Returns the running scheduler.
+    """
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from apscheduler.triggers.cron import CronTrigger
+
+    hour, minute = (int(v) for v in at.split(":"))
+
+    def daily_job():
+        enqueue_absent_emails(db_path, csv_path, kind="daily")
+        if worker is not None:
+            worker.wake()
+
+    scheduler = BackgroundScheduler(daemon=True)
+    scheduler.add_job(
+        daily_job,
+        CronTrigger(hour=hour, minute=minute),
+        id="daily_absent_emails",
+        coalesce=True,
+        misfire_grace_time=3600,
+    )
+    scheduler.start()
+    print(f"[*] Daily absent emails scheduled at {at}")
+    return scheduler
@@ -0,0 +1,113 @@
+from collections import Counter, deque
+
+
+def iou(a, b):
+    """Intersection over union of two (x, y, w, h) boxes."""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union > 0 else 0.0
+
+
+def _centroid_close(a, b):
+    # fallback for fast movement: centres within half the larger box size
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    dx = (ax + aw / 2) - (bx + bw / 2)
+    dy = (ay + ah / 2) - (by + bh / 2)
+    limit = max(aw, ah, bw, bh) / 2
+    return dx * dx + dy * dy <= limit * limit
+
+
+class Track:
+    """One face followed across frames, with a sliding window of recognition votes."""
+
+    def __init__(self, track_id, box, window):
+        self.track_id = track_id
+        self.box = tuple(int(v) for v in box)
+        self.votes = deque(maxlen=window)
+        self.label = None
+        self.confidence = None
+        self.missed = 0
+
+    @property
+    def confirmed(self):
+        return self.label is not None
+
+    def add_prediction(self, label, confidence, votes_needed):
+        """Record one predict() result (label None = not recognized). Returns True when this vote confirms the track."""
+        self.votes.append((label, confidence))
+        counts = Counter(l for l, _ in self.votes if l is not None)
+        if not counts:
+            return False
+        best, n = counts.most_common(1)[0]
+        if n < votes_needed:
+            return False
+        self.label = best
+        confs = [c for l, c in self.votes if l == best]
+        self.confidence = sum(confs) / len(confs)
+        return True
+
+
+class FaceTracker:
+    """Lightweight multi-face tracker for the live loops.
+
+    Boxes from each frame are associated with existing tracks by IoU (falling
+    back to centroid distance), so a face is only passed to predict() until
+    ``votes_needed`` of its last ``window`` predictions agree on a label. After
+    that the track keeps its identity, without predict calls or DB writes,
+    until it has been missing for more than ``max_missed`` frames.
+    """
+
+    def __init__(self, iou_threshold=0.3, votes_needed=3, window=5, max_missed=10):
+        self.iou_threshold = iou_threshold
+        self.votes_needed = votes_needed
+        self.window = window
+        self.max_missed = max_missed
+        self.tracks = []
+        self._next_id = 1
+
+    def update(self, boxes):
+        """Associate this frame's (x, y, w, h) boxes with tracks. Returns one Track per box, in order."""
+        boxes = [tuple(int(v) for v in b) for b in boxes]
+        pairs = []
+        for ti, t in enumerate(self.tracks):
+            for bi, b in enumerate(boxes):
+                score = iou(t.box, b)
+                if score >= self.iou_threshold or _centroid_close(t.box, b):
+                    pairs.append((score, ti, bi))
+        # greedy assignment, best overlap first
+        pairs.sort(reverse=True)
+        assigned = [None] * len(boxes)
+        used_tracks = set()
+        for _, ti, bi in pairs:
+            if ti in used_tracks or assigned[bi] is not None:
+                continue
+            used_tracks.add(ti)
+            track = self.tracks[ti]
+            track.box = boxes[bi]
+            track.missed = 0
+            assigned[bi] = track
+
+        kept = []
+        for ti, t in enumerate(self.tracks):
+            if ti not in used_tracks:
+                t.missed += 1
+                if t.missed > self.max_missed:
+                    continue
+            kept.append(t)
+        for bi, b in enumerate(boxes):
+            if assigned[bi] is None:
+                track = Track(self._next_id, b, self.window)
+                self._next_id += 1
+                assigned[bi] = track
+                kept.append(track)
+        self.tracks = kept
+        return assigned
+
+    def observe(self, track, label, confidence):
+        """Add a predict() result to track. Returns True when the track becomes confirmed."""
+        return track.add_prediction(label, confidence, self.votes_needed)
@@ -0,0 +1,48 @@
+import cv2
+import numpy as np
+
+# every face crop is resized to this (width, height) before training and prediction
+FACE_SIZE = (200, 200)
+
+
+def normalize_face(gray_crop, size=FACE_SIZE):
+    """Resize a grayscale face crop to the fixed training size."""
+    h, w = gray_crop.shape[:2]
+    if (w, h) == size:
+        return gray_crop
+    # INTER_AREA avoids aliasing when shrinking large crops / whole-image fallbacks
+    interp = cv2.INTER_AREA if w > size[0] or h > size[1] else cv2.INTER_LINEAR
+    return cv2.resize(gray_crop, size, interpolation=interp)
+
+
+def detection_scale(frame_width, detect_width=None):
+    """Scale factor that brings a frame down to detect_width pixels wide (never upscales)."""
+    if not detect_width or frame_width <= detect_width:
+        return 1.0
+    return detect_width / float(frame_width)
+
+
+def detect_faces(detector, gray, scale=1.0, scaleFactor=1.1, minNeighbors=5, minSize=(60, 60)):
+    """
+    Run the cascade on a copy of gray resized by scale and map the boxes back
+    to full-resolution (x, y, w, h) coordinates, so callers crop from the original.
+    minSize is given in full-resolution pixels.
+    """
+    if scale >= 1.0:
+        return detector.detectMultiScale(
+            gray, scaleFactor=scaleFactor, minNeighbors=minNeighbors, minSize=minSize
+        )
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    small_min = (max(1, int(round(minSize[0] * scale))), max(1, int(round(minSize[1] * scale))))
+    boxes = detector.detectMultiScale(
+        small, scaleFactor=scaleFactor, minNeighbors=minNeighbors, minSize=small_min
+    )
+    if len(boxes) == 0:
+        return boxes
+    h, w = gray.shape[:2]
+    out = []
+    for x, y, bw, bh in boxes:
+        x0 = min(w - 1, int(round(x / scale)))
+        y0 = min(h - 1, int(round(y / scale)))
+        out.append((x0, y0, min(w - x0, int(round(bw / scale))), min(h - y0, int(round(bh / scale)))))
+    return np.array(out, dtype=np.int32)
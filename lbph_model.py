@@ -0,0 +1,484 @@
+import argparse
+import json
+import math
+import os
+import re
+import time
+
+import numpy as np
+
+# binary model files, written next to trainer.yml / labels.pickle. The arrays
+# carry a generation number (lbph_histograms.<n>.npy) and the header names the
+# current one, so a save never replaces a file another process has mapped.
+HEADER_FILE = "lbph_header.json"
+ARRAY_FILES = {
+    "histograms": "lbph_histograms.{}.npy",
+    "sums": "lbph_sums.{}.npy",
+    "labels": "lbph_labels.{}.npy",
+}
+_GENERATION_RE = re.compile(r"^lbph_(?:histograms|sums|labels)\.(\d+)\.npy$")
+# attempts at replacing the header while a reader briefly has it open (Windows)
+REPLACE_ATTEMPTS = 10
+FORMAT = "lbph-npy"
+FORMAT_VERSION = 2
+# training histograms copied per step while writing the matrix
+WRITE_BLOCK = 256
+# labels reported per face by --verify
+VERIFY_TOP_K = 3
+DBL_MAX = np.finfo(np.float64).max
+
+
+def elbp(src, radius=1, neighbors=8):
+    """
+    Extended (circular) LBP codes of a grayscale image, or of a stack of
+    equally sized images (..., rows, cols), computed exactly as OpenCV's
+    LBPHFaceRecognizer does: float32 bilinear sampling of each neighbour,
+    which sets its bit when >= the centre pixel. Returns int32 codes of shape
+    (..., rows - 2 * radius, cols - 2 * radius).
+    """
+    src = np.asarray(src, dtype=np.float32)
+    h, w = src.shape[-2:]
+    center = src[..., radius : h - radius, radius : w - radius]
+    out = np.zeros(center.shape, np.int32)
+    eps = np.finfo(np.float32).eps
+    one = np.float32(1.0)
+
+    def shifted(dy, dx):
+        return src[..., radius + dy : h - radius + dy, radius + dx : w - radius + dx]
+
+    for n in range(neighbors):
+        x = np.float32(radius * math.cos(2.0 * math.pi * n / neighbors))
+        y = np.float32(-radius * math.sin(2.0 * math.pi * n / neighbors))
+        fx, fy = int(math.floor(x)), int(math.floor(y))
+        cx, cy = int(math.ceil(x)), int(math.ceil(y))
+        ty = y - np.float32(fy)
+        tx = x - np.float32(fx)
+        w1 = (one - tx) * (one - ty)
+        w2 = tx * (one - ty)
+        w3 = (one - tx) * ty
+        w4 = tx * ty
+        t = (
+            w1 * shifted(fy, fx)
+            + w2 * shifted(fy, cx)
+            + w3 * shifted(cy, fx)
+            + w4 * shifted(cy, cx)
+        )
+        bit = (t > center) | (np.abs(t - center) < eps)
+        out |= bit.astype(np.int32) << n
+    return out
+
+
+def spatial_histograms(lbp, num_patterns=256, grid_x=8, grid_y=8):
+    """
+    Concatenated per-cell histograms of LBP codes, each normalized by the cell
+    size (float32), for a stack of code images (batch, rows, cols). One
+    bincount covers the whole batch: every code is offset by its image and
+    cell. Returns shape (batch, grid_x * grid_y * num_patterns).
+    """
+    lbp = np.asarray(lbp)
+    batch, h, w = lbp.shape
+    cells = grid_y * grid_x
+    cell_h, cell_w = h // grid_y, w // grid_x
+    if cell_h == 0 or cell_w == 0:
+        return np.zeros((batch, cells * num_patterns), np.float32)
+    # like OpenCV, pixels past the last full cell are ignored
+    codes = lbp[:, : grid_y * cell_h, : grid_x * cell_w]
+    cell_of = (np.arange(grid_y * cell_h) // cell_h)[:, None] * grid_x + np.arange(grid_x * cell_w) // cell_w
+    offsets = (np.arange(batch)[:, None, None] * cells + cell_of) * num_patterns
+    counts = np.bincount((offsets + codes).ravel(), minlength=batch * cells * num_patterns)
+    scale = np.float32(1.0 / (cell_h * cell_w))
+    return counts.reshape(batch, cells * num_patterns).astype(np.float32) * scale
+
+
+def chi_square_alt(bins, sums, query):
+    """
+    OpenCV's HISTCMP_CHISQR_ALT distance, 2 * sum((a - q)^2 / (a + q)), from
+    query to every training histogram a. ``bins`` is the bins-major matrix
+    (bins[j] holds bin j of every training histogram) and ``sums`` the per-
+    histogram totals. Bins where q is 0 contribute a, so they are covered by
+    sums minus the bins that q does use; only those (a few thousand of the
+    16384 for a face) are read.
+    """
+    q = np.asarray(query, dtype=np.float64)
+    used = np.flatnonzero(q)
+    a = bins[used]
+    qu = q[used][:, None]
+    diff = a - qu
+    np.multiply(diff, diff, out=diff)
+    np.divide(diff, a + qu, out=diff)
+    return 2.0 * (sums - a.sum(axis=0, dtype=np.float64) + diff.sum(axis=0))
+
+
+def chi_square_alt_batch(bins, sums, queries):
+    """chi_square_alt for each row of queries. Returns a (queries, training histograms) float64 matrix."""
+    out = np.empty((len(queries), len(sums)), np.float64)
+    for i, q in enumerate(queries):
+        out[i] = chi_square_alt(bins, sums, q)
+    return out
+
+
+class BinaryLBPH:
+    """
+    LBPH recognizer backed by a bins-major histogram matrix (usually memory-
+    mapped from lbph_histograms.<n>.npy). ``predict`` follows
+    cv2.face.LBPHFaceRecognizer: nearest training histogram by chi-square,
+    (-1, DBL_MAX) when nothing is closer than ``threshold``.
+    """
+
+    def __init__(self, bins, sums, labels, radius=1, neighbors=8, grid_x=8, grid_y=8, threshold=None):
+        self.bins = bins
+        self.sums = sums
+        self.labels = labels
+        self.radius = radius
+        self.neighbors = neighbors
+        self.grid_x = grid_x
+        self.grid_y = grid_y
+        self.threshold = DBL_MAX if threshold is None else threshold
+        # training histograms grouped by label, for per-label minimum distances
+        labels = np.asarray(labels)
+        self._by_label = np.argsort(labels, kind="stable")
+        self.classes, self._label_starts = np.unique(labels[self._by_label], return_index=True)
+
+    def histogram(self, src):
+        return self.histograms([src])[0]
+
+    def histograms(self, crops):
+        """Histograms of a batch of grayscale crops, one row each. Equally sized crops share one pass."""
+        crops = [np.asarray(c) for c in crops]
+        out = np.empty((len(crops), self.bins.shape[0]), np.float32)
+        by_shape = {}
+        for i, crop in enumerate(crops):
+            by_shape.setdefault(crop.shape, []).append(i)
+        for idx in by_shape.values():
+            lbp = elbp(np.stack([crops[i] for i in idx]), self.radius, self.neighbors)
+            out[idx] = spatial_histograms(lbp, 2 ** self.neighbors, self.grid_x, self.grid_y)
+        return out
+
+    def distances(self, crops):
+        """Chi-square distance from every crop to every training histogram, shape (crops, training images)."""
+        return chi_square_alt_batch(self.bins, self.sums, self.histograms(crops))
+
+    def predict(self, src):
+        if len(self.labels) == 0:
+            return -1, DBL_MAX
+        dists = chi_square_alt(self.bins, self.sums, self.histogram(src))
+        # argmin keeps the first of equal distances, like OpenCV's strict < scan
+        best = int(np.argmin(dists))
+        if not dists[best] < self.threshold:
+            return -1, DBL_MAX
+        return int(self.labels[best]), float(dists[best])
+
+    def predict_batch(self, crops):
+        """predict for a batch of crops: [(label, distance)], with the same threshold rule."""
+        if len(crops) == 0:
+            return []
+        if len(self.labels) == 0:
+            return [(-1, DBL_MAX)] * len(crops)
+        dists = self.distances(crops)
+        best = np.argmin(dists, axis=1)
+        out = []
+        for row, i in zip(dists, best):
+            if row[i] < self.threshold:
+                out.append((int(self.labels[i]), float(row[i])))
+            else:
+                out.append((-1, DBL_MAX))
+        return out
+
+    def top_k(self, crops, k=VERIFY_TOP_K):
+        """
+        The k closest labels for each crop: [[(label, distance), ...]] nearest
+        first, where a label's distance is that of its closest training
+        histogram. The threshold is not applied.
+        """
+        if len(crops) == 0 or len(self.labels) == 0:
+            return [[] for _ in crops]
+        dists = self.distances(crops)
+        per_label = np.minimum.reduceat(dists[:, self._by_label], self._label_starts, axis=1)
+        order = np.argsort(per_label, axis=1, kind="stable")[:, :k]
+        return [
+            [(int(self.classes[j]), float(row[j])) for j in idx]
+            for row, idx in zip(per_label, order)
+        ]
+
+
+_batch_error_logged = False
+
+
+def predict_many(recognizer, crops):
+    """
+    (label, distance) for each crop, or None where the recognizer failed.
+    A BinaryLBPH scores the whole batch at once; a cv2 recognizer is called
+    crop by crop, as is a BinaryLBPH whose batch fails (logged once).
+    """
+    if len(crops) == 0:
+        return []
+    if hasattr(recognizer, "predict_batch"):
+        try:
+            return recognizer.predict_batch(crops)
+        except Exception as e:
+            global _batch_error_logged
+            if not _batch_error_logged:
+                _batch_error_logged = True
+                print(f"[!] Batch predict failed, predicting face by face: {e!r}")
+    out = []
+    for crop in crops:
+        try:
+            out.append(recognizer.predict(crop))
+        except Exception:
+            out.append(None)
+    return out
+
+
+def has_binary_model(model_dir="model"):
+    return os.path.exists(os.path.join(model_dir, HEADER_FILE))
+
+
+def read_header(model_dir="model"):
+    with open(os.path.join(model_dir, HEADER_FILE), "r", encoding="utf-8") as f:
+        header = json.load(f)
+    if header.get("format") != FORMAT or header.get("version") != FORMAT_VERSION:
+        raise RuntimeError(f"Unsupported binary model in {model_dir}: {header.get('format')} v{header.get('version')}")
+    return header
+
+
+def _generations(model_dir):
+    """Generation numbers that have array files in model_dir."""
+    found = set()
+    for name in os.listdir(model_dir):
+        m = _GENERATION_RE.match(name)
+        if m:
+            found.add(int(m.group(1)))
+    return found
+
+
+def _replace(src, dst):
+    for attempt in range(REPLACE_ATTEMPTS):
+        try:
+            os.replace(src, dst)
+            return
+        except PermissionError:
+            if attempt == REPLACE_ATTEMPTS - 1:
+                raise
+            time.sleep(0.05)
+
+
+def remove_old_generations(model_dir="model"):
+    """
+    Delete array files of generations older than the header's (newer ones may
+    belong to a save in progress). Files that are still mapped by some process
+    cannot be deleted on Windows; they are left for a later call. Returns the
+    number of files removed.
+    """
+    try:
+        current = read_header(model_dir)["generation"]
+    except (OSError, ValueError, KeyError, RuntimeError):
+        return 0
+    removed = 0
+    for gen in sorted(g for g in _generations(model_dir) if g < current):
+        for pattern in ARRAY_FILES.values():
+            try:
+                os.remove(os.path.join(model_dir, pattern.format(gen)))
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # still memory-mapped somewhere
+                pass
+    return removed
+
+
+def save_binary_model(recognizer, model_dir="model", source=None):
+    """
+    Write a cv2 LBPH recognizer's histograms as one contiguous float32 matrix
+    stored bins-major (shape (bins, images), so a prediction reads only the
+    rows of the bins its query uses), their float64 totals, and the int32
+    labels as .npy files plus a JSON header. The arrays go to new files of the
+    next generation, and replacing the header is the single commit point: a
+    reader sees either the old model or the new one, and files other
+    processes have mapped are never overwritten. Older generations are removed
+    afterwards where they are no longer mapped. ``source`` is the trainer.yml
+    this was produced from; its mtime/size are recorded so a stale binary
+    model can be detected.
+    """
+    histograms = recognizer.getHistograms()
+    labels = np.asarray(recognizer.getLabels(), dtype=np.int32).reshape(-1)
+    count = len(histograms)
+    dim = int(histograms[0].size) if histograms else 0
+    os.makedirs(model_dir, exist_ok=True)
+    generation = max(_generations(model_dir), default=0) + 1
+    files = {key: pattern.format(generation) for key, pattern in ARRAY_FILES.items()}
+    hist_path = os.path.join(model_dir, files["histograms"])
+    # filled a block of images at a time so no second full copy is built in memory
+    matrix = np.lib.format.open_memmap(hist_path, mode="w+", dtype=np.float32, shape=(dim, count))
+    sums = np.empty(count, np.float64)
+    for start in range(0, count, WRITE_BLOCK):
+        block = np.stack(
+            [np.asarray(h, dtype=np.float32).reshape(-1) for h in histograms[start : start + WRITE_BLOCK]]
+        )
+        matrix[:, start : start + len(block)] = block.T
+        sums[start : start + len(block)] = block.sum(axis=1, dtype=np.float64)
+    matrix.flush()
+    del matrix
+    np.save(os.path.join(model_dir, files["sums"]), sums)
+    np.save(os.path.join(model_dir, files["labels"]), labels)
+
+    threshold = recognizer.getThreshold()
+    header = {
+        "format": FORMAT,
+        "version": FORMAT_VERSION,
+        "generation": generation,
+        "files": files,
+        "count": count,
+        "dim": dim,
+        "layout": "bins-major",
+        "radius": recognizer.getRadius(),
+        "neighbors": recognizer.getNeighbors(),
+        "grid_x": recognizer.getGridX(),
+        "grid_y": recognizer.getGridY(),
+        "threshold": None if threshold >= DBL_MAX else threshold,
+        "source": None,
+    }
+    if source and os.path.exists(source):
+        st = os.stat(source)
+        header["source"] = {"file": os.path.basename(source), "mtime_ns": st.st_mtime_ns, "size": st.st_size}
+    header_path = os.path.join(model_dir, HEADER_FILE)
+    with open(header_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(header, f, indent=1)
+    _replace(header_path + ".tmp", header_path)
+    remove_old_generations(model_dir)
+    print(f"[+] Binary model saved to: {hist_path} ({count} histograms x {dim} bins, float32)")
+    return header
+
+
+def is_stale(model_dir="model", header=None):
+    """True if the trainer.yml the binary model was made from has changed since."""
+    header = header or read_header(model_dir)
+    source = header.get("source")
+    if not source:
+        return False
+    path = os.path.join(model_dir, source["file"])
+    if not os.path.exists(path):
+        return False
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size) != (source["mtime_ns"], source["size"])
+
+
+def _load_generation(model_dir, mode):
+    header = read_header(model_dir)
+    files = header["files"]
+    bins = np.load(os.path.join(model_dir, files["histograms"]), mmap_mode=mode)
+    sums = np.load(os.path.join(model_dir, files["sums"]))
+    labels = np.load(os.path.join(model_dir, files["labels"]))
+    return header, bins, sums, labels
+
+
+def load_binary_model(model_dir="model", mmap=True):
+    """BinaryLBPH for model_dir. With mmap the histogram pages are shared by every process using the model."""
+    mode = "r" if mmap else None
+    try:
+        header, bins, sums, labels = _load_generation(model_dir, mode)
+    except FileNotFoundError:
+        # a save committed a new generation and removed this one in between
+        header, bins, sums, labels = _load_generation(model_dir, mode)
+    count = header["count"]
+    if bins.shape != (header["dim"], count) or len(sums) != count or len(labels) != count:
+        raise RuntimeError(f"Binary model in {model_dir} does not match its header")
+    return BinaryLBPH(
+        bins,
+        sums,
+        labels,
+        header["radius"],
+        header["neighbors"],
+        header["grid_x"],
+        header["grid_y"],
+        header["threshold"],
+    )
+
+
+def convert(model_dir="model", trainer_file="trainer.yml"):
+    """Convert an existing trainer.yml in model_dir to the binary format."""
+    import cv2
+
+    trainer_path = os.path.join(model_dir, trainer_file)
+    if not os.path.exists(trainer_path):
+        raise RuntimeError(f"No trainer found at {trainer_path}")
+    try:
+        recognizer = cv2.face.LBPHFaceRecognizer_create()
+    except AttributeError:
+        raise RuntimeError("cv2.face not found. Install opencv-contrib-python.")
+    print(f"[*] Reading {trainer_path} ...")
+    recognizer.read(trainer_path)
+    return save_binary_model(recognizer, model_dir, trainer_path)
+
+
+def verify(dataset_dir="dataset", model_dir="model", k=VERIFY_TOP_K, trainer_file="trainer.yml"):
+    """
+    Predict every face of dataset_dir with cv2 (trainer.yml) and with the
+    binary model's batch matcher and compare them. Returns the number of faces
+    whose labels differ.
+    """
+    import time
+
+    import cv2
+
+    from train import _cache_dir, iter_samples, scan_dataset
+
+    if not has_binary_model(model_dir):
+        raise RuntimeError(f"No binary model in {model_dir}. Run python lbph_model.py --model-dir {model_dir} first.")
+    recognizer = cv2.face.LBPHFaceRecognizer_create()
+    recognizer.read(os.path.join(model_dir, trainer_file))
+    binary = load_binary_model(model_dir)
+    _, tasks = scan_dataset(dataset_dir)
+    crops, ids = [], []
+    for crop, person_id in iter_samples(tasks, cache_dir=_cache_dir(model_dir, True)):
+        crops.append(crop)
+        ids.append(person_id)
+    print(f"[*] Comparing {len(crops)} face(s) from {dataset_dir}")
+
+    start = time.perf_counter()
+    expected = [recognizer.predict(crop) for crop in crops]
+    cv2_time = time.perf_counter() - start
+    start = time.perf_counter()
+    got = binary.predict_batch(crops)
+    batch_time = time.perf_counter() - start
+    top = binary.top_k(crops, k)
+
+    mismatches = 0
+    max_diff = 0.0
+    for (want, want_dist), (label, dist) in zip(expected, got):
+        if want != label:
+            mismatches += 1
+        elif label != -1:
+            max_diff = max(max_diff, abs(want_dist - dist))
+    in_top = sum(person_id in [label for label, _ in t] for person_id, t in zip(ids, top))
+    n = max(len(crops), 1)
+    print(f"[*] cv2 predict: {cv2_time * 1000 / n:.1f} ms/face, batch matcher: {batch_time * 1000 / n:.1f} ms/face")
+    print(f"[*] Max distance difference: {max_diff:.3g}")
+    print(f"[*] Dataset label in top-{k}: {in_top}/{len(crops)}")
+    if mismatches:
+        print(f"[!] {mismatches} face(s) predicted differently from cv2")
+    else:
+        print("[+] All predictions match cv2")
+    return mismatches
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Convert an LBPH trainer.yml to the binary, memory-mappable model format"
+    )
+    parser.add_argument("--model-dir", default="model", help="Directory holding trainer.yml")
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Compare the batch matcher with cv2 predictions on --dataset instead of converting",
+    )
+    parser.add_argument("--dataset", default="dataset", help="Dataset used by --verify")
+    parser.add_argument("--top-k", type=int, default=VERIFY_TOP_K, help="Labels per face reported by --verify")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.verify:
+        raise SystemExit(1 if verify(args.dataset, args.model_dir, args.top_k) else 0)
+    convert(args.model_dir)
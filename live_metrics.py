@@ -0,0 +1,142 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# histogram bucket upper bounds in milliseconds; the last bucket is open-ended
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+STAGES = ("read", "cvtColor", "detect", "predict", "db_write")
+
+
+class RollingHistogram:
+    """Latency samples (seconds) over the last ``window`` observations."""
+
+    def __init__(self, window=300):
+        self.samples = deque(maxlen=window)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def summary(self):
+        values = sorted(self.samples)
+        if not values:
+            return {"count": 0}
+        n = len(values)
+        ms = [v * 1000.0 for v in values]
+        buckets = [0] * (len(BUCKETS_MS) + 1)
+        for v in ms:
+            for i, bound in enumerate(BUCKETS_MS):
+                if v <= bound:
+                    buckets[i] += 1
+                    break
+            else:
+                buckets[-1] += 1
+        return {
+            "count": n,
+            "mean_ms": round(sum(ms) / n, 3),
+            "p50_ms": round(ms[n // 2], 3),
+            "p95_ms": round(ms[min(n - 1, int(n * 0.95))], 3),
+            "max_ms": round(ms[-1], 3),
+            "buckets": dict(
+                zip([f"<={b}ms" for b in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}ms"], buckets)
+            ),
+        }
+
+
+class LiveMetrics:
+    """Per-stage timings, FPS and dropped frames for one live loop.
+
+    Stages are timed with ``with metrics.stage("detect"): ...``. Every
+    ``report_interval`` seconds a one-line summary is printed and, if
+    ``jsonl_path`` is set, the full snapshot is appended to it as one JSON line.
+    ``set_detection`` records the camera's frame size and detection scale,
+    which are part of every report.
+    """
+
+    def __init__(self, name="camera", window=300, report_interval=10.0, jsonl_path=None):
+        self.name = str(name)
+        self.window = window
+        self.report_interval = report_interval
+        self.jsonl_path = jsonl_path
+        self.stages = {s: RollingHistogram(window) for s in STAGES}
+        self.frames = 0
+        self.dropped = 0
+        self.frame_size = None
+        self.detect_scale = None
+        self._frame_times = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._last_report = time.monotonic()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, stage, seconds):
+        with self._lock:
+            hist = self.stages.get(stage)
+            if hist is None:
+                hist = self.stages[stage] = RollingHistogram(self.window)
+            hist.add(seconds)
+
+    def set_detection(self, frame_width, frame_height, scale):
+        with self._lock:
+            self.frame_size = [int(frame_width), int(frame_height)]
+            self.detect_scale = round(float(scale), 4)
+
+    def drop(self, n=1):
+        with self._lock:
+            self.dropped += n
+
+    def frame_done(self):
+        with self._lock:
+            self.frames += 1
+            self._frame_times.append(time.monotonic())
+        self.maybe_report()
+
+    def fps(self):
+        with self._lock:
+            if len(self._frame_times) < 2:
+                return 0.0
+            span = self._frame_times[-1] - self._frame_times[0]
+            return (len(self._frame_times) - 1) / span if span > 0 else 0.0
+
+    def snapshot(self):
+        fps = self.fps()
+        with self._lock:
+            return {
+                "ts": time.time(),
+                "camera": self.name,
+                "frames": self.frames,
+                "dropped": self.dropped,
+                "fps": round(fps, 2),
+                "frame_size": self.frame_size,
+                "detect_scale": self.detect_scale,
+                "stages": {k: v.summary() for k, v in self.stages.items()},
+            }
+
+    def maybe_report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_report < self.report_interval:
+            return
+        self._last_report = now
+        snap = self.snapshot()
+        parts = [
+            f"{k} p50={v['p50_ms']:.1f}ms p95={v['p95_ms']:.1f}ms"
+            for k, v in snap["stages"].items()
+            if v["count"]
+        ]
+        detect = ""
+        if snap["detect_scale"] is not None:
+            detect = f", detect scale {snap['detect_scale']:.2f}"
+        print(
+            f"[metrics] {self.name}: {snap['fps']:.1f} fps, {snap['frames']} frames, "
+            f"{snap['dropped']} dropped{detect} | " + ", ".join(parts)
+        )
+        if self.jsonl_path:
+            with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(snap) + "\n")
@@ -0,0 +1,215 @@
+import queue
+import threading
+import time
+
+import cv2
+
+from attendance import camera_scale, draw_faces, draw_frame_stats, process_frame, writer_mark
+from attendance_writer import get_writer
+from live_metrics import LiveMetrics
+from model_registry import CASCADE_PATH, get_model
+
+
+class LatestFrameCapture:
+    """Reads a VideoCapture on its own thread and keeps only the newest frame.
+
+    Each frame is handed out at most once; frames replaced before any worker
+    took them are counted in ``dropped`` (and in ``metrics``, if given).
+    """
+
+    def __init__(self, cap, metrics=None):
+        self.cap = cap
+        self.metrics = metrics
+        self.dropped = 0
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self._taken = 0
+        self._ts = 0.0
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="capture", daemon=True)
+        self._thread.start()
+
+    @property
+    def stopped(self):
+        return self._stopped
+
+    def _run(self):
+        while not self._stopped:
+            start = time.perf_counter()
+            ret, frame = self.cap.read()
+            if self.metrics is not None:
+                self.metrics.record("read", time.perf_counter() - start)
+            with self._cond:
+                if not ret:
+                    print("[!] Failed to read frame from camera.")
+                    self._stopped = True
+                    self._cond.notify_all()
+                    break
+                if self._seq > self._taken:
+                    self.dropped += 1
+                    if self.metrics is not None:
+                        self.metrics.drop()
+                self._frame = frame
+                self._seq += 1
+                self._ts = time.monotonic()
+                self._cond.notify_all()
+
+    def read(self, timeout=0.5):
+        """Return (seq, timestamp, frame) for a frame no caller has taken yet, or None."""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._stopped or self._seq > self._taken, timeout
+            )
+            if self._seq <= self._taken:
+                return None
+            self._taken = self._seq
+            return self._seq, self._ts, self._frame
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join(timeout=2.0)
+
+
+def _recognize_worker(
+    capture, model_dir, threshold, detect_width, out_q, stop, stats, metrics, writer
+):
+    # cascades are not safe to share between threads, so each worker owns one
+    detector = cv2.CascadeClassifier(CASCADE_PATH)
+    mark = writer_mark(writer)
+    while not stop.is_set():
+        item = capture.read()
+        if item is None:
+            if capture.stopped:
+                break
+            continue
+        seq, ts, frame = item
+        model = get_model(model_dir)
+        if "scale" not in stats:
+            stats["scale"] = camera_scale(frame, detect_width, metrics, metrics.name)
+        scale = stats["scale"]
+        # marked here, so a result that is too late to display still counts;
+        # drawing is left to the sink, which may skip it
+        faces, results = process_frame(
+            frame, model, scale, threshold, metrics, mark=mark, detector=detector, draw=False
+        )
+        result = (seq, ts, frame, results, model.labels_map, scale, len(faces))
+        try:
+            out_q.put_nowait(result)
+        except queue.Full:
+            # sink is behind: drop the oldest pending result (already marked) rather than block
+            try:
+                out_q.get_nowait()
+                stats["stale"] += 1
+                metrics.drop()
+            except queue.Empty:
+                pass
+            try:
+                out_q.put_nowait(result)
+            except queue.Full:
+                stats["stale"] += 1
+                metrics.drop()
+
+
+def run_pipelined(
+    model_dir="model",
+    db_path="attendance.db",
+    cam_index=0,
+    confidence_threshold=70,
+    workers=2,
+    max_latency=0.5,
+    queue_size=None,
+    detect_width=None,
+    headless=False,
+    metrics=None,
+):
+    """
+    Live attendance with capture, recognition and output on separate stages:
+    a capture thread keeping only the latest frame, ``workers`` detection /
+    recognition threads that also mark attendance, and this thread as the
+    display sink. Every result is marked; results older than ``max_latency``
+    seconds or older than the last shown frame are only left undrawn, so the
+    preview's latency stays bounded when recognition falls behind.
+    Frames are processed out of order by the pool, so the face tracker is not used
+    here; repeated marks are absorbed by the attendance writer.
+    Stage timings and drops are recorded in ``metrics`` (a LiveMetrics).
+    """
+    if metrics is None:
+        metrics = LiveMetrics(cam_index)
+    get_model(model_dir)
+    writer = get_writer(db_path)
+    cap = cv2.VideoCapture(cam_index)
+    if not cap.isOpened():
+        raise RuntimeError(f"Cannot open camera {cam_index}")
+
+    capture = LatestFrameCapture(cap, metrics)
+    out_q = queue.Queue(maxsize=queue_size or workers * 2)
+    stop = threading.Event()
+    stats = {"stale": 0}
+    pool = [
+        threading.Thread(
+            target=_recognize_worker,
+            args=(
+                capture,
+                model_dir,
+                confidence_threshold,
+                detect_width,
+                out_q,
+                stop,
+                stats,
+                metrics,
+                writer,
+            ),
+            name=f"recognize-{i}",
+            daemon=True,
+        )
+        for i in range(workers)
+    ]
+    for t in pool:
+        t.start()
+
+    print(
+        f"[*] Starting pipelined camera with {workers} worker(s). Press "
+        + ("Ctrl+C" if headless else "'q'")
+        + " to quit."
+    )
+    last_seq = 0
+    try:
+        while True:
+            try:
+                seq, ts, frame, results, labels_map, scale, n_faces = out_q.get(
+                    timeout=0.5
+                )
+            except queue.Empty:
+                if capture.stopped and not any(t.is_alive() for t in pool):
+                    break
+                continue
+            if headless:
+                continue
+            if seq <= last_seq or time.monotonic() - ts > max_latency:
+                # too late or out of order to show; its marks were already written
+                stats["stale"] += 1
+                continue
+            last_seq = seq
+            draw_faces(frame, results, labels_map)
+            draw_frame_stats(frame, scale, n_faces, metrics.fps())
+            cv2.imshow("Attendance", frame)
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        capture.stop()
+        for t in pool:
+            t.join(timeout=2.0)
+        cap.release()
+        writer.flush()
+        if not headless:
+            cv2.destroyAllWindows()
+        metrics.maybe_report(force=True)
+        print(
+            f"[*] Frames dropped at capture: {capture.dropped}, stale results not shown: {stats['stale']}"
+        )
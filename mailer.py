@@ -0,0 +1,207 @@
+import queue
+import smtplib
+import socket
+import threading
+import time
+from email.message import EmailMessage
+from typing import Dict, Iterable, List, Tuple
+
+# exceptions after which the session is dropped and the message retried
+TRANSIENT_ERRORS = (
+    smtplib.SMTPServerDisconnected,
+    smtplib.SMTPConnectError,
+    socket.timeout,
+    ConnectionError,
+)
+
+
+def build_message(smtp_config: Dict, to_email: str, subject: str, body: str):
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["From"] = smtp_config.get("from") or smtp_config.get("user")
+    msg["To"] = to_email
+    msg.set_content(body)
+    return msg
+
+
+def _is_transient(exc):
+    if isinstance(exc, TRANSIENT_ERRORS):
+        return True
+    # 4xx replies are temporary per RFC 5321 (greylisting, rate limits, busy mailbox)
+    code = getattr(exc, "smtp_code", None)
+    if code is None and isinstance(exc, smtplib.SMTPRecipientsRefused):
+        codes = [c for c, _ in exc.recipients.values()]
+        code = min(codes) if codes else None
+    return code is not None and 400 <= code < 500
+
+
+class RateLimiter:
+    """Token bucket shared by all connections: at most ``rate`` messages per second."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + 1.0 / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+
+class MailSender:
+    """Sends many messages over a small pool of reused, authenticated SMTP sessions.
+
+    smtp_config keys: host, port, user, pass, use_tls (bool) as for utils.send_email.
+    The optional "security" key overrides use_tls: "starttls", "ssl" or "none"
+    (plain SMTP, e.g. a local relay or test server). Login is skipped when no user is set.
+    Each of ``pool_size`` worker threads keeps one session open for up to
+    ``messages_per_connection`` messages. Transient failures (disconnects, 4xx
+    replies) reconnect and retry with exponential backoff up to ``max_retries`` times.
+    Logins are serialized until one succeeds, and an authentication failure
+    fails the rest of the batch, so a wrong password costs one login attempt
+    rather than one per message.
+    """
+
+    def __init__(
+        self,
+        smtp_config: Dict,
+        pool_size=4,
+        rate_limit=None,
+        max_retries=3,
+        retry_backoff=1.0,
+        messages_per_connection=100,
+        timeout=30,
+    ):
+        self.smtp_config = smtp_config
+        self.pool_size = max(1, int(pool_size))
+        self.limiter = RateLimiter(rate_limit)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.messages_per_connection = messages_per_connection
+        self.timeout = timeout
+
+    def _security(self):
+        security = self.smtp_config.get("security")
+        if security:
+            return security
+        return "starttls" if self.smtp_config.get("use_tls", True) else "ssl"
+
+    def _connect(self):
+        host = self.smtp_config.get("host")
+        port = int(self.smtp_config.get("port") or 587)
+        user = self.smtp_config.get("user")
+        password = self.smtp_config.get("pass")
+        security = self._security()
+        if security == "ssl":
+            server = smtplib.SMTP_SSL(host, port, timeout=self.timeout)
+        else:
+            server = smtplib.SMTP(host, port, timeout=self.timeout)
+            server.ehlo()
+            if security == "starttls":
+                server.starttls()
+                server.ehlo()
+        if user:
+            server.login(user, password)
+        return server
+
+    @staticmethod
+    def _close(server):
+        if server is None:
+            return
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def _login(self, state):
+        """_connect, one thread at a time until a login has worked. Raises the stored error after an auth failure."""
+        if state["logged_in"]:
+            return self._connect()
+        with state["lock"]:
+            if state["auth_error"] is not None:
+                raise state["auth_error"]
+            try:
+                server = self._connect()
+            except smtplib.SMTPAuthenticationError as e:
+                state["auth_error"] = e
+                raise
+            state["logged_in"] = True
+            return server
+
+    def _worker(self, jobs, sent, failed, lock, state):
+        server = None
+        used = 0
+        while True:
+            try:
+                to_email, subject, body = jobs.get_nowait()
+            except queue.Empty:
+                break
+            if state["auth_error"] is not None:
+                with lock:
+                    failed.append((to_email, f"Not sent, SMTP login failed: {state['auth_error']}"))
+                continue
+            msg = build_message(self.smtp_config, to_email, subject, body)
+            attempt = 0
+            while True:
+                try:
+                    if server is None or used >= self.messages_per_connection:
+                        self._close(server)
+                        server = None
+                        server = self._login(state)
+                        used = 0
+                    self.limiter.wait()
+                    server.send_message(msg)
+                    used += 1
+                    with lock:
+                        sent.append(to_email)
+                    break
+                except Exception as e:
+                    if isinstance(e, TRANSIENT_ERRORS):
+                        # the session is unusable; reconnect on the next attempt
+                        self._close(server)
+                        server = None
+                    elif server is not None:
+                        try:
+                            server.rset()
+                        except Exception:
+                            self._close(server)
+                            server = None
+                    attempt += 1
+                    if not _is_transient(e) or attempt > self.max_retries:
+                        with lock:
+                            failed.append((to_email, str(e)))
+                        break
+                    time.sleep(self.retry_backoff * (2 ** (attempt - 1)))
+        self._close(server)
+
+    def send_many(
+        self, messages: Iterable[Tuple[str, str, str]]
+    ) -> Tuple[List[str], List[Tuple[str, str]]]:
+        """Send (to_email, subject, body) messages. Returns (sent addresses, [(address, error)])."""
+        jobs = queue.Queue()
+        for m in messages:
+            jobs.put(m)
+        sent, failed = [], []
+        lock = threading.Lock()
+        state = {"lock": threading.Lock(), "logged_in": False, "auth_error": None}
+        n = min(self.pool_size, jobs.qsize())
+        threads = [
+            threading.Thread(
+                target=self._worker, args=(jobs, sent, failed, lock, state), name=f"smtp-{i}"
+            )
+            for i in range(n)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return sent, failed
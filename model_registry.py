@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+
+import cv2
+
+import lbph_model
+from utils import load_labels
+
+# constants
+CASCADE_PATH = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+TRAINER_FILE = "trainer.yml"
+LABELS_FILE = "labels.pickle"
+
+
+class LoadedModel:
+    """Warm recognizer, labels map and face detector for one model directory."""
+
+    def __init__(self, model_dir, recognizer, labels_map, detector, version):
+        self.model_dir = model_dir
+        self.recognizer = recognizer
+        self.labels_map = labels_map
+        self.detector = detector
+        self.version = version
+        self.loaded_at = time.time()
+
+
+def _file_version(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def model_version(model_dir="model"):
+    """Return a tuple identifying the current model files on disk (mtime/size of each)."""
+    trainer_path = os.path.join(model_dir, TRAINER_FILE)
+    labels_path = os.path.join(model_dir, LABELS_FILE)
+    header_path = os.path.join(model_dir, lbph_model.HEADER_FILE)
+    has_binary = os.path.exists(header_path)
+    if not os.path.exists(trainer_path) and not has_binary:
+        raise RuntimeError(f"No trainer found at {trainer_path}. Run train.py first.")
+    if not os.path.exists(labels_path):
+        raise RuntimeError(
+            f"No labels file found at {labels_path}. Run train.py first."
+        )
+    trainer = _file_version(trainer_path) if os.path.exists(trainer_path) else None
+    binary = _file_version(header_path) if has_binary else None
+    return (trainer, _file_version(labels_path), binary)
+
+
+def _load_recognizer(model_dir):
+    """
+    The binary model (memory-mapped, see lbph_model.py) when there is an
+    up-to-date one, otherwise the cv2 LBPH recognizer read from trainer.yml.
+    """
+    trainer_path = os.path.join(model_dir, TRAINER_FILE)
+    if lbph_model.has_binary_model(model_dir):
+        try:
+            if not lbph_model.is_stale(model_dir):
+                return lbph_model.load_binary_model(model_dir)
+            print(f"[!] Binary model in {model_dir} is older than {TRAINER_FILE}; using {TRAINER_FILE}")
+        except RuntimeError as e:
+            # e.g. a format written by an older version; convert again to use it
+            print(f"[!] {e}; using {TRAINER_FILE}")
+    try:
+        recognizer = cv2.face.LBPHFaceRecognizer_create()
+    except AttributeError:
+        raise RuntimeError("cv2.face not found. Install opencv-contrib-python.")
+    recognizer.read(trainer_path)
+    return recognizer
+
+
+def _load(model_dir, version):
+    labels_path = os.path.join(model_dir, LABELS_FILE)
+    recognizer = _load_recognizer(model_dir)
+    labels_map = load_labels(labels_path)
+    detector = cv2.CascadeClassifier(CASCADE_PATH)
+    return LoadedModel(model_dir, recognizer, labels_map, detector, version)
+
+
+class ModelRegistry:
+    """Process-wide cache of loaded models keyed by model directory.
+
+    Models are loaded on first use and reloaded only when the mtime/size of
+    trainer.yml or labels.pickle changes. File stats are throttled to at most
+    one per ``check_interval`` seconds per directory so the live loops can
+    call ``get`` on every frame. If a reload fails (e.g. files caught mid-write
+    by a retrain) while a model is already loaded, the error is logged and the
+    old model keeps being served until the files load cleanly.
+    """
+
+    def __init__(self, check_interval=1.0):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._models = {}
+        self._checked = {}
+
+    def get(self, model_dir="model"):
+        key = os.path.abspath(model_dir)
+        with self._lock:
+            model = self._models.get(key)
+            now = time.monotonic()
+            if model is not None and now - self._checked.get(key, 0) < self.check_interval:
+                return model
+            self._checked[key] = now
+            try:
+                version = model_version(model_dir)
+                if model is not None and model.version == version:
+                    return model
+                if model is not None:
+                    print(f"[*] Model files changed in {model_dir}, reloading...")
+                loaded = _load(model_dir, version)
+            except Exception as e:
+                if model is None:
+                    raise
+                print(f"[!] Could not reload model from {model_dir}, keeping the loaded one: {e}")
+                return model
+            model = self._models[key] = loaded
+            # files of replaced binary models, once nothing maps them any more
+            lbph_model.remove_old_generations(model_dir)
+            return model
+
+    def invalidate(self, model_dir=None):
+        """Drop cached models so the next ``get`` reloads from disk."""
+        with self._lock:
+            if model_dir is None:
+                self._models.clear()
+                self._checked.clear()
+            else:
+                key = os.path.abspath(model_dir)
+                self._models.pop(key, None)
+                self._checked.pop(key, None)
+
+
+_registry = ModelRegistry()
+
+
+def get_model(model_dir="model"):
+    """Return the warm LoadedModel for model_dir from the shared registry."""
+    return _registry.get(model_dir)
+
+
+def invalidate(model_dir=None):
+    _registry.invalidate(model_dir)
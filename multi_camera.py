@@ -0,0 +1,154 @@
+import datetime
+import multiprocessing as mp
+import queue
+
+import cv2
+
+from attendance import camera_scale, process_frame
+from attendance_writer import get_writer
+from face_tracker import FaceTracker
+from live_metrics import LiveMetrics
+from model_registry import get_model
+
+
+def parse_source(src):
+    """Camera index for digit strings ("0", "1"), otherwise a file path / stream URL."""
+    return int(src) if str(src).isdigit() else src
+
+
+def _camera_worker(
+    source,
+    model_dir,
+    threshold,
+    detect_width,
+    track,
+    marks_q,
+    stop,
+    headless,
+    metrics_interval,
+    metrics_jsonl,
+):
+    """Runs detection/recognition for one camera and sends confirmed marks to the parent."""
+    metrics = LiveMetrics(source, report_interval=metrics_interval, jsonl_path=metrics_jsonl)
+    try:
+        # with the fork start method this is the parent's already-loaded model
+        model = get_model(model_dir)
+        cap = cv2.VideoCapture(source)
+        if not cap.isOpened():
+            print(f"[!] Cannot open camera {source}")
+            return
+        tracker = FaceTracker() if track else None
+        window = f"Attendance {source}"
+        scale = None
+
+        def mark(label_id, name):
+            # the parent's writer does the actual DB write; this times the hand-off
+            marks_q.put((int(label_id), name, str(source)))
+
+        print(f"[*] Camera {source} started.")
+        while not stop.is_set():
+            with metrics.stage("read"):
+                ret, frame = cap.read()
+            if not ret:
+                print(f"[!] Failed to read frame from camera {source}.")
+                break
+            model = get_model(model_dir)
+            if scale is None:
+                scale = camera_scale(frame, detect_width, metrics, source)
+            process_frame(frame, model, scale, threshold, metrics, tracker, mark, draw=not headless)
+            if headless:
+                continue
+            cv2.imshow(window, frame)
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                stop.set()
+        cap.release()
+        if not headless:
+            cv2.destroyAllWindows()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        metrics.maybe_report(force=True)
+
+
+def run_multi(
+    sources,
+    model_dir="model",
+    db_path="attendance.db",
+    threshold=70,
+    detect_width=None,
+    track=True,
+    headless=False,
+    metrics_interval=10.0,
+    metrics_jsonl=None,
+):
+    """
+    Live attendance for several cameras / video sources at once. Each source runs
+    in its own process; all marks are funnelled through a queue to a single
+    attendance writer in this process, so only one connection writes to SQLite.
+    The model is loaded here before the workers start; where the fork start
+    method is available the workers share its pages read-only instead of
+    loading their own copy.
+    """
+    sources = [parse_source(s) for s in sources]
+    get_model(model_dir)
+    method = "fork" if "fork" in mp.get_all_start_methods() else "spawn"
+    ctx = mp.get_context(method)
+    marks_q = ctx.Queue()
+    stop = ctx.Event()
+    procs = [
+        ctx.Process(
+            target=_camera_worker,
+            args=(
+                src,
+                model_dir,
+                threshold,
+                detect_width,
+                track,
+                marks_q,
+                stop,
+                headless,
+                metrics_interval,
+                metrics_jsonl,
+            ),
+            name=f"camera-{src}",
+        )
+        for src in sources
+    ]
+    for p in procs:
+        p.start()
+    # started after forking so the writer thread and its connection live only here
+    writer = get_writer(db_path)
+
+    print(
+        f"[*] Started {len(procs)} camera process(es). Press "
+        + ("Ctrl+C" if headless else "'q' in any window")
+        + " to quit."
+    )
+    try:
+        while True:
+            try:
+                label_id, name, source = marks_q.get(timeout=0.5)
+            except queue.Empty:
+                if not any(p.is_alive() for p in procs):
+                    break
+                continue
+            if writer.mark(label_id, name):
+                print(
+                    f"[+] Attendance marked for {name} on camera {source} at {datetime.datetime.now().strftime('%H:%M:%S')}"
+                )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        for p in procs:
+            p.join(timeout=5.0)
+            if p.is_alive():
+                p.terminate()
+        # marks sent just before the workers stopped
+        while True:
+            try:
+                label_id, name, source = marks_q.get_nowait()
+            except (queue.Empty, EOFError, OSError):
+                break
+            writer.mark(label_id, name)
+        writer.flush()
@@ -0,0 +1,113 @@
+import threading
+
+import cv2
+import numpy as np
+
+from face_utils import detect_faces, normalize_face
+from lbph_model import predict_many
+from model_registry import CASCADE_PATH
+
+_local = threading.local()
+
+
+def thread_detector():
+    """Haar cascade owned by the calling thread (cascades are not safe to share across threads)."""
+    detector = getattr(_local, "detector", None)
+    if detector is None:
+        detector = _local.detector = cv2.CascadeClassifier(CASCADE_PATH)
+    return detector
+
+
+class SharedDetector:
+    """Haar cascade that can be shared by several threads: detectMultiScale calls are serialized."""
+
+    def __init__(self, path=CASCADE_PATH):
+        self._cascade = cv2.CascadeClassifier(path)
+        self._lock = threading.Lock()
+
+    def detectMultiScale(self, *args, **kwargs):
+        with self._lock:
+            return self._cascade.detectMultiScale(*args, **kwargs)
+
+
+def decode_image(image_bytes):
+    """Decode encoded image bytes to (bgr, gray). Returns (None, None) if they are not an image."""
+    arr = np.frombuffer(image_bytes, np.uint8)
+    img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
+    if img is None:
+        return None, None
+    return img, cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
+def detect(gray, detector=None, scaleFactor=1.1, minNeighbors=5, minSize=(60, 60), detect_scale=1.0):
+    """Detect faces in a decoded grayscale image. Returns a list of (x, y, w, h) tuples."""
+    faces = detect_faces(
+        detector or thread_detector(),
+        gray,
+        detect_scale,
+        scaleFactor=scaleFactor,
+        minNeighbors=minNeighbors,
+        minSize=minSize,
+    )
+    return [tuple(int(v) for v in f) for f in faces]
+
+
+def recognize(model, crops, threshold):
+    """
+    Predict normalized face crops against model. Returns one dict per crop:
+    {id, name, confidence, recognized}; id/name are None when not recognized.
+    A binary model scores all crops in one batch.
+    """
+    out = []
+    for pred in predict_many(model.recognizer, crops):
+        label_id, conf = pred if pred is not None else (None, 999.0)
+        recognized = label_id is not None and conf < threshold
+        out.append(
+            {
+                "id": int(label_id) if recognized else None,
+                "name": model.labels_map.get(label_id, f"ID_{label_id}") if recognized else None,
+                "confidence": float(conf),
+                "recognized": recognized,
+            }
+        )
+    return out
+
+
+def recognize_batch(model, images, threshold=70, cache=None, **detect_kwargs):
+    """
+    Recognize faces across a batch of (image_name, image_bytes). Every image is
+    decoded and detected first, then all face crops of the batch are predicted
+    in one pass. Returns one dict per image: {image, faces: [...]} or {image, error}.
+    With a result_cache.ResultCache, images seen before with the same threshold,
+    detection parameters and model skip decoding, detection and prediction.
+    """
+    results = []
+    crops = []
+    owners = []
+    fresh = []
+    for name, data in images:
+        key = None
+        if cache is not None:
+            key = cache.key(data, model, threshold=threshold, **detect_kwargs)
+            faces = cache.get(key)
+            if faces is not None:
+                results.append({"image": name, "faces": faces})
+                continue
+        _, gray = decode_image(data)
+        if gray is None:
+            results.append({"image": name, "error": "Could not decode image"})
+            continue
+        entry = {"image": name, "faces": []}
+        results.append(entry)
+        if key is not None:
+            fresh.append((key, entry))
+        for box in detect(gray, **detect_kwargs):
+            x, y, w, h = box
+            crops.append(normalize_face(gray[y : y + h, x : x + w]))
+            owners.append((entry, box))
+    for (entry, box), pred in zip(owners, recognize(model, crops, threshold)):
+        pred["box"] = list(box)
+        entry["faces"].append(pred)
+    for key, entry in fresh:
+        cache.put(key, entry["faces"])
+    return results
@@ -0,0 +1,70 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """Bounded LRU of recognition results.
+
+    Entries are keyed by the sha1 of the image bytes together with the detection
+    / recognition parameters and the model identity, so a retrained model or a
+    changed slider never returns a stale result. Values are deep-copied in and
+    out, so callers may annotate what they get back.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def key(image_bytes, model=None, **params):
+        """Cache key for image_bytes recognized by ``model`` (a LoadedModel) with ``params``."""
+        h = hashlib.sha1(image_bytes)
+        ident = (os.path.abspath(model.model_dir), model.version) if model is not None else None
+        h.update(json.dumps([ident, params], sort_keys=True, default=str).encode("utf-8"))
+        return h.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return copy.deepcopy(value)
+
+    def put(self, key, value):
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Process-wide ResultCache (RESULT_CACHE_SIZE entries, default 256)."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = ResultCache(int(os.getenv("RESULT_CACHE_SIZE", "256")))
+        return _shared
@@ -1,7 +1,15 @@
 import streamlit as st
 import pandas as pd
-from datetime import date
-from streamlit_utils import get_students, get_attendance, send_absent_emails, export_csv
+from datetime import date, timedelta
+from streamlit_utils import (
+    get_students,
+    get_attendance,
+    send_absent_emails,
+    export_csv,
+    get_email_jobs,
+    get_email_job,
+    get_attendance_summary,
+)
 import os
 import time
 import json
@@ -25,6 +33,14 @@ def load_saved_smtp():
     return None
 
 
+@st.cache_resource
+def cached_detector():
+    """One Haar cascade shared by every session and rerun."""
+    from recognition import SharedDetector
+
+    return SharedDetector()
+
+
 def save_smtp(cfg: dict):
     try:
         with open(SMTP_CONFIG_PATH, "w", encoding="utf-8") as f:
@@ -55,6 +71,14 @@ if page == "Dashboard":
         df.columns = ["id", "name", "date", "time"]
         st.dataframe(df)
 
+    # one aggregated request for the week instead of one request per day
+    week = get_attendance_summary(
+        (today - timedelta(days=6)).isoformat(), today.isoformat()
+    )
+    if week:
+        st.subheader("Last 7 days")
+        st.bar_chart(pd.DataFrame(week).set_index("date")["present"])
+
     if st.button("Export CSV for date"):
         content = export_csv(today.isoformat())
         if content:
@@ -75,6 +99,30 @@ elif page == "Students":
         df = pd.DataFrame(students)
         st.dataframe(df)
 
+elif page == "Reports":
+    st.header("Reports")
+    c1, c2 = st.columns(2)
+    date_from = c1.date_input("From", value=date.today().replace(day=1))
+    date_to = c2.date_input("To", value=date.today())
+    from attendance_archive import read_attendance
+
+    # archived days come from the Parquet archive, later days from the live DB
+    report = read_attendance(
+        "attendance.db",
+        os.getenv("ARCHIVE_DIR", "archive"),
+        date_from.isoformat(),
+        date_to.isoformat(),
+    )
+    if report.empty:
+        st.info("No attendance recorded in this range.")
+    else:
+        st.subheader("Students present per day")
+        st.bar_chart(report.groupby("date").size())
+        st.subheader("Days present per student")
+        st.dataframe(
+            report.groupby(["id", "name"]).size().rename("days").reset_index()
+        )
+
 elif page == "Settings":
     st.header("Settings")
     st.subheader("SMTP Configuration")
@@ -124,9 +172,8 @@ elif page == "Attendance":
     st.subheader("Absent Students & Email Notifications")
     # load the master students list (API fallback to CSV)
     students = get_students()
-    # build a map of present ids
-    present_ids = {r[0] for r in rows} if rows else set()
-    absent = [s for s in students if s.get("id") not in present_ids]
+    # absentees come from the DB (roster anti-joined with attendance for the date)
+    absent = get_students(absent_on=date_sel.isoformat()) if students else []
 
     if not students:
         st.info("No student roster available (check `students.csv` or API).")
@@ -158,21 +205,22 @@ elif page == "Attendance":
                     "pass": os.getenv("SMTP_PASS", ""),
                     "use_tls": True,
                 }
-                sent = []
                 failed = []
-                from utils import send_email
+                from mailer import MailSender
+                from utils import absent_notice
 
+                messages = []
+                by_email = {}
                 for s in sel_students:
                     if not s.get("email"):
                         failed.append((s, "no email"))
                         continue
-                    subject = f"Absent Notice for {date_sel.isoformat()}"
-                    body = f"Hello {s['name']},\n\nYou were marked absent on {date_sel.isoformat()}. If this is a mistake, please contact the administration.\n\nRegards,\nAttendance System"
-                    try:
-                        send_email(smtp, s["email"], subject, body)
-                        sent.append(s["email"])
-                    except Exception as e:
-                        failed.append((s, str(e)))
+                    subject, body = absent_notice(s["name"], date_sel.isoformat())
+                    messages.append((s["email"], subject, body))
+                    by_email[s["email"]] = s
+                # one pool of reused SMTP sessions for the whole selection
+                sent, send_failed = MailSender(smtp).send_many(messages)
+                failed.extend((by_email[email], err) for email, err in send_failed)
 
                 if sent:
                     st.success(f"Sent emails to: {', '.join(sent)}")
@@ -195,11 +243,10 @@ elif page == "Attendance":
                     "pass": os.getenv("SMTP_PASS", ""),
                     "use_tls": True,
                 }
-                from utils import send_email
+                from utils import send_email, absent_notice
 
                 try:
-                    subject = f"Absent Notice for {date_sel.isoformat()}"
-                    body = f"Hello {s['name']},\n\nYou were marked absent on {date_sel.isoformat()}. If this is a mistake, please contact the administration.\n\nRegards,\nAttendance System"
+                    subject, body = absent_notice(s["name"], date_sel.isoformat())
                     send_email(smtp, s.get("email", ""), subject, body)
                     st.success(f"Email sent to {s['name']} ({s.get('email')})")
                 except Exception as e:
@@ -249,6 +296,14 @@ elif page == "Attendance":
         min_size_px = st.number_input(
             "minSize (px)", value=60, min_value=10, max_value=500, step=1
         )
+        detect_scale = st.number_input(
+            "Detection scale (run detection on a downscaled copy)",
+            value=1.0,
+            min_value=0.1,
+            max_value=1.0,
+            step=0.05,
+            format="%.2f",
+        )
 
         auto_send_absent = st.checkbox(
             "Automatically send absent emails for unrecognized faces",
@@ -268,54 +323,92 @@ elif page == "Attendance":
         if camera_input is not None:
             with st.spinner("Processing camera feed..."):
                 try:
-                    from streamlit_utils import recognize_and_mark
+                    import hashlib
+                    from result_cache import get_result_cache
+                    from streamlit_utils import (
+                        recognize_and_mark,
+                        recognize_snapshot,
+                        decode_image,
+                        detect_image_faces,
+                    )
 
                     img_bytes = camera_input.getvalue()
                     start_time = time.time()
 
-                    # Show captured frame for debugging with face overlay
                     try:
-                        import cv2
-                        import numpy as np
-
-                        arr = np.frombuffer(img_bytes, np.uint8)
-                        vis = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-                        vis_rgb = cv2.cvtColor(vis, cv2.COLOR_BGR2RGB)
-
-                        # Detect faces for overlay
-                        gray = cv2.cvtColor(vis, cv2.COLOR_BGR2GRAY)
-                        detector = cv2.CascadeClassifier(
-                            cv2.data.haarcascades
-                            + "haarcascade_frontalface_default.xml"
-                        )
-                        faces = detector.detectMultiScale(
-                            gray,
+                        from model_registry import get_model
+
+                        # process-wide warm model, reloaded by the registry after a retrain
+                        model = get_model("model")
+                    except Exception:
+                        # recognize_and_mark reports the missing / broken model
+                        model = None
+
+                    if model is not None:
+                        # decoded and detected once, shared by the preview and recognition;
+                        # reruns with the same snapshot and settings are served from the cache
+                        vis, faces, res = recognize_snapshot(
+                            img_bytes,
+                            model,
+                            cached_detector(),
+                            threshold=threshold,
                             scaleFactor=scale,
                             minNeighbors=neighbors,
                             minSize=(min_size_px, min_size_px),
+                            detect_scale=detect_scale,
+                            cache=get_result_cache(),
                         )
-                        for x, y, w, h in faces:
-                            cv2.rectangle(
-                                vis_rgb, (x, y), (x + w, y + h), (255, 0, 0), 2
+                    else:
+                        vis, gray = decode_image(img_bytes)
+                        faces = []
+                        if vis is not None:
+                            faces = detect_image_faces(
+                                gray,
+                                cached_detector(),
+                                scaleFactor=scale,
+                                minNeighbors=neighbors,
+                                minSize=(min_size_px, min_size_px),
+                                detect_scale=detect_scale,
                             )
+                        res = recognize_and_mark(
+                            img_bytes,
+                            threshold=threshold,
+                            scaleFactor=scale,
+                            minNeighbors=neighbors,
+                            minSize=(min_size_px, min_size_px),
+                            detect_scale=detect_scale,
+                            gray=gray,
+                            faces=faces,
+                            detector=cached_detector(),
+                        )
+
+                    # Show captured frame for debugging with face overlay
+                    try:
+                        import cv2
+
+                        # the last overlay is kept so a cached rerun does not decode again
+                        preview_key = (hashlib.sha1(img_bytes).hexdigest(), str(faces))
+                        preview = st.session_state.get("camera_preview")
+                        if preview is None or preview[0] != preview_key:
+                            if vis is None:
+                                vis, _ = decode_image(img_bytes)
+                            vis_rgb = cv2.cvtColor(vis, cv2.COLOR_BGR2RGB)
+                            for x, y, w, h in faces:
+                                cv2.rectangle(
+                                    vis_rgb, (x, y), (x + w, y + h), (255, 0, 0), 2
+                                )
+                            preview = (preview_key, vis_rgb)
+                            st.session_state["camera_preview"] = preview
+                        vis_rgb = preview[1]
 
                         st.image(
                             vis_rgb,
-                            caption=f"Camera frame (preview) - {len(faces)} face(s) detected",
+                            caption=f"Camera frame (preview) - {len(faces)} face(s) detected at scale {detect_scale:.2f} ({vis_rgb.shape[1]}x{vis_rgb.shape[0]})",
                             use_container_width=True,
                         )
                     except Exception as e:
                         st.write(f"Preview error: {e}")
 
-                    # Process the camera frame
-                    res = recognize_and_mark(
-                        img_bytes,
-                        threshold=threshold,
-                        scaleFactor=scale,
-                        minNeighbors=neighbors,
-                        minSize=(min_size_px, min_size_px),
-                    )
-
                     processing_time = time.time() - start_time
 
                     if isinstance(res, dict) and res.get("error"):
@@ -411,7 +504,29 @@ elif page == "Attendance":
         if res and isinstance(res, dict) and res.get("error"):
             st.error(f"Failed: {res.get('error')}")
         else:
-            st.success("Absent email routine invoked (see server logs)")
+            st.session_state["email_job_id"] = res.get("job_id")
+            st.success(
+                f"Queued {res.get('queued', 0)} absent email(s) as job #{res.get('job_id')}"
+            )
+
+    # progress of queued absent-email jobs (sent in the background by the API)
+    job_id = st.session_state.get("email_job_id")
+    if job_id:
+        job = get_email_job(job_id)
+        if job.get("error"):
+            st.warning(f"Could not load job #{job_id}: {job['error']}")
+        else:
+            st.write(
+                f"Job #{job_id}: {job['status']} — {job['sent']} sent, "
+                f"{job['failed']} failed, {job['pending']} pending of {job['total']}"
+            )
+            for f in job.get("failures", []):
+                st.caption(f"{f['email']}: {f['error']}")
+    # clicking reruns the script, which reloads the job list below
+    st.button("Refresh email jobs")
+    jobs = get_email_jobs(10)
+    if jobs:
+        st.dataframe(pd.DataFrame(jobs))
 
     st.markdown("---")
     st.subheader("Export Attendance")
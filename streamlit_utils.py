@@ -1,20 +1,142 @@
 import requests
 import os
+import threading
+import time
+from collections import OrderedDict
 from typing import List, Dict
 
+from requests.adapters import HTTPAdapter
+
 API_BASE = os.getenv("API_BASE", "http://localhost:5000/api")
 
 
-def get_students() -> List[Dict]:
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the API while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Stops calling an API that keeps failing.
+
+    After ``failure_threshold`` consecutive failures (connection errors,
+    timeouts, 5xx replies) the circuit opens and calls fail at once with
+    CircuitOpenError, so callers go straight to their local fallback. While
+    open, a background thread GETs ``probe_url`` every ``probe_interval``
+    seconds and closes the circuit on the first healthy reply.
+    """
+
+    def __init__(
+        self, session, probe_url, failure_threshold=3, probe_interval=5.0, probe_timeout=1.0
+    ):
+        self.session = session
+        self.probe_url = probe_url
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._open = False
+
+    @property
+    def is_open(self):
+        return self._open
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._open or self._failures < self.failure_threshold:
+                return
+            self._open = True
+        print(f"[!] API unreachable, using local fallback until {self.probe_url} answers")
+        threading.Thread(target=self._probe, name="api-probe", daemon=True).start()
+
+    def _probe(self):
+        while True:
+            time.sleep(self.probe_interval)
+            try:
+                r = self.session.get(self.probe_url, timeout=self.probe_timeout)
+                healthy = r.status_code < 500
+            except requests.RequestException:
+                healthy = False
+            if healthy:
+                with self._lock:
+                    self._open = False
+                    self._failures = 0
+                print("[+] API reachable again")
+                return
+
+
+# one keep-alive connection pool for every call to the API
+_session = requests.Session()
+_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+_breaker = CircuitBreaker(_session, f"{API_BASE}/health")
+
+
+def _request(method: str, path: str, timeout=5, **kwargs):
+    """Call API_BASE + path on the shared session, through the circuit breaker."""
+    if _breaker.is_open:
+        raise CircuitOpenError(f"API at {API_BASE} is unavailable")
     try:
-        r = requests.get(f"{API_BASE}/students", timeout=5)
-        r.raise_for_status()
-        return r.json()
+        r = _session.request(method, f"{API_BASE}{path}", timeout=timeout, **kwargs)
+    except (requests.ConnectionError, requests.Timeout):
+        _breaker.record_failure()
+        raise
+    if r.status_code >= 500:
+        _breaker.record_failure()
+    else:
+        _breaker.record_success()
+    return r
+
+# (path, params) -> (etag, last_modified, data, headers) of the last 200 response,
+# so unchanged data is revalidated with a 304 instead of re-downloaded
+_validated = OrderedDict()
+_validated_lock = threading.Lock()
+VALIDATED_MAX = 128
+
+
+def _get_json(path: str, params: Dict = None, timeout=5):
+    """GET API_BASE + path, sending the validators of a previous response. Returns (data, headers)."""
+    key = (path, tuple(sorted((params or {}).items())))
+    with _validated_lock:
+        cached = _validated.get(key)
+    headers = {}
+    if cached:
+        if cached[0]:
+            headers["If-None-Match"] = cached[0]
+        if cached[1]:
+            headers["If-Modified-Since"] = cached[1]
+    r = _request("GET", path, timeout, params=params, headers=headers)
+    if r.status_code == 304 and cached:
+        with _validated_lock:
+            if key in _validated:
+                _validated.move_to_end(key)
+        return cached[2], cached[3]
+    r.raise_for_status()
+    data = r.json()
+    etag, last_modified = r.headers.get("ETag"), r.headers.get("Last-Modified")
+    if etag or last_modified:
+        with _validated_lock:
+            _validated[key] = (etag, last_modified, data, dict(r.headers))
+            _validated.move_to_end(key)
+            while len(_validated) > VALIDATED_MAX:
+                _validated.popitem(last=False)
+    return data, r.headers
+
+
+def get_students(absent_on: str = None) -> List[Dict]:
+    """Roster, or only the students absent on absent_on (YYYY-MM-DD) when given."""
+    params = {"absent_on": absent_on} if absent_on else {}
+    try:
+        return _get_json("/students", params)[0]
     except Exception:
-        # Fallback to local CSV if API not available
-        from utils import load_students
+        # Fallback to the local roster (synced from students.csv) if API not available
+        from utils import query_students
 
-        return load_students()
+        return query_students(absent_on=absent_on)
 
 
 def get_attendance(date_str: str = None):
@@ -22,15 +144,26 @@ def get_attendance(date_str: str = None):
         params = {}
         if date_str:
             params["date"] = date_str
-        r = requests.get(f"{API_BASE}/attendance", params=params, timeout=5)
-        r.raise_for_status()
-        return r.json()
+        return _get_json("/attendance", params)[0]
     except Exception:
         from utils import get_attendance as local_get_attendance
 
         return local_get_attendance(date_str=date_str)
 
 
+def get_attendance_summary(date_from: str, date_to: str, group_by: str = "day"):
+    """Per-day or per-student attendance counts, aggregated by the API."""
+    params = {"from": date_from, "to": date_to, "group_by": group_by}
+    try:
+        return _get_json("/attendance", params, timeout=10)[0]
+    except Exception:
+        from utils import attendance_summary
+
+        return attendance_summary(
+            date_from=date_from, date_to=date_to, group_by=group_by
+        )
+
+
 def send_absent_emails(smtp: Dict = None, date_str: str = None):
     payload = {}
     if smtp:
@@ -38,25 +171,105 @@ def send_absent_emails(smtp: Dict = None, date_str: str = None):
     if date_str:
         payload["date"] = date_str
     try:
-        r = requests.post(f"{API_BASE}/send_absent_emails", json=payload, timeout=10)
+        r = _request("POST", "/send_absent_emails", 10, json=payload)
         r.raise_for_status()
         return r.json()
     except Exception as e:
         return {"error": str(e)}
 
 
+def get_email_jobs(limit: int = 20) -> List[Dict]:
+    """Recent absent-email jobs with their progress (most recent first)."""
+    try:
+        r = _request("GET", "/email_jobs", params={"limit": limit})
+        r.raise_for_status()
+        return r.json()
+    except Exception:
+        from email_outbox import list_jobs
+
+        return list_jobs(os.getenv("DB_PATH", "attendance.db"), limit)
+
+
+def get_email_job(job_id: int):
+    try:
+        r = _request("GET", f"/email_jobs/{job_id}")
+        r.raise_for_status()
+        return r.json()
+    except Exception as e:
+        from email_outbox import get_job
+
+        job = get_job(os.getenv("DB_PATH", "attendance.db"), job_id)
+        return job if job is not None else {"error": str(e)}
+
+
 def export_csv(date_str: str = None):
     try:
         params = {}
         if date_str:
             params["date"] = date_str
-        r = requests.get(f"{API_BASE}/export_csv", params=params, timeout=10)
+        r = _request("GET", "/export_csv", 10, params=params)
         r.raise_for_status()
         return r.content
     except Exception as e:
         return None
 
 
+def decode_image(image_bytes):
+    """Decode uploaded image bytes to (bgr, gray); (None, None) if they are not an image."""
+    from recognition import decode_image as _decode
+
+    return _decode(image_bytes)
+
+
+def detect_image_faces(
+    gray,
+    detector=None,
+    scaleFactor=1.1,
+    minNeighbors=5,
+    minSize=(60, 60),
+    detect_scale=1.0,
+):
+    """Face boxes (x, y, w, h) in an already-decoded grayscale image."""
+    from recognition import detect
+
+    return detect(gray, detector, scaleFactor, minNeighbors, minSize, detect_scale)
+
+
+def recognize_faces(model, gray, faces, threshold=70):
+    """Predict each box in faces; returns only recognized faces as {id, name, confidence}."""
+    from face_utils import normalize_face
+    from recognition import recognize
+
+    crops = [normalize_face(gray[y : y + h, x : x + w]) for x, y, w, h in faces]
+    out = []
+    for pred in recognize(model, crops, threshold):
+        if pred["recognized"]:
+            out.append(
+                {
+                    "id": pred["id"],
+                    "name": pred["name"],
+                    "confidence": pred["confidence"],
+                    "debug": f"Recognized label_id={pred['id']}, conf={pred['confidence']:.1f} < {threshold}",
+                }
+            )
+    return out
+
+
+def mark_recognized(results, db_path="attendance.db"):
+    """Mark attendance for recognized faces, setting "marked" on each result."""
+    from attendance_writer import get_writer
+
+    if not results:
+        return results
+    writer = get_writer(db_path)
+    for r in results:
+        r["marked"] = writer.mark(r["id"], r["name"])
+    # make the new rows visible to the attendance table refresh that follows
+    if not writer.flush():
+        return {"error": f"Attendance could not be saved: {writer.last_error or 'timed out'}"}
+    return results
+
+
 def recognize_and_mark(
     image_bytes,
     model_dir="model",
@@ -65,70 +278,116 @@ def recognize_and_mark(
     scaleFactor=1.1,
     minNeighbors=5,
     minSize=(60, 60),
+    detect_scale=1.0,
+    gray=None,
+    faces=None,
+    model=None,
+    detector=None,
 ):
     """Try to recognize faces in the uploaded image_bytes. If a face matches, mark attendance and return results list.
+    detect_scale < 1 runs detection on a downscaled copy; crops still come from the full image.
+    Callers that already decoded the image and/or detected faces (e.g. for a preview)
+    pass gray and faces so neither step runs twice. model defaults to the
+    process-wide warm model, detector to this thread's own cascade.
     Returns list of dicts: [{id, name, confidence, marked(bool)}]
     """
     try:
-        import cv2
-        import numpy as np
-        import pickle
-        from utils import load_labels, mark_attendance_db, ensure_dir
+        from model_registry import get_model, model_version
+        from recognition import thread_detector
     except Exception as e:
         return {"error": f"Missing imaging dependencies: {e}"}
 
-    # load labels and recognizer
-    labels_path = os.path.join(model_dir, "labels.pickle")
-    trainer_path = os.path.join(model_dir, "trainer.yml")
-    if not os.path.exists(trainer_path) or not os.path.exists(labels_path):
-        return {"error": "Trained model or labels not found. Run train.py first."}
+    if model is None:
+        # warm labels/recognizer, reloaded only when the model files change;
+        # model_version accepts trainer.yml or a binary-only model
+        try:
+            model_version(model_dir)
+        except RuntimeError:
+            return {"error": "Trained model or labels not found. Run train.py first."}
+        try:
+            model = get_model(model_dir)
+        except Exception as e:
+            return {"error": f"Failed to load recognizer: {e}"}
 
-    with open(labels_path, "rb") as f:
-        labels = pickle.load(f)
+    if gray is None:
+        _, gray = decode_image(image_bytes)
+        if gray is None:
+            return {"error": "Could not decode uploaded image"}
 
-    try:
-        recognizer = cv2.face.LBPHFaceRecognizer_create()
-        recognizer.read(trainer_path)
-    except Exception as e:
-        return {"error": f"Failed to load recognizer: {e}"}
+    if faces is None:
+        faces = detect_image_faces(
+            gray,
+            detector or thread_detector(),
+            scaleFactor,
+            minNeighbors,
+            minSize,
+            detect_scale,
+        )
+    if len(faces) == 0:
+        return {"error": "No faces detected in image"}
 
-    # load image
-    arr = np.frombuffer(image_bytes, np.uint8)
-    img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-    if img is None:
-        return {"error": "Could not decode uploaded image"}
+    # Skip unrecognized faces - don't add them to results
+    return mark_recognized(recognize_faces(model, gray, faces, threshold), db_path)
 
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    detector = cv2.CascadeClassifier(
-        cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
-    )
-    faces = detector.detectMultiScale(
-        gray, scaleFactor=scaleFactor, minNeighbors=minNeighbors, minSize=minSize
-    )
 
-    results = []
-    if len(faces) == 0:
-        return {"error": "No faces detected in image"}
+def recognize_snapshot(
+    image_bytes,
+    model,
+    detector=None,
+    threshold=70,
+    scaleFactor=1.1,
+    minNeighbors=5,
+    minSize=(60, 60),
+    detect_scale=1.0,
+    db_path="attendance.db",
+    cache=None,
+):
+    """
+    Decode, detect, recognize and mark one camera snapshot. With a
+    result_cache.ResultCache, a snapshot already processed today with the same
+    parameters and model returns the stored faces and results (including the
+    "marked" flags from the first run) without any OpenCV work or new marks.
+    Returns (bgr, faces, results); bgr is None when the cache answered.
+    """
+    from datetime import date
 
-    for x, y, w, h in faces:
-        face_gray = gray[y : y + h, x : x + w]
-        try:
-            label_id, conf = recognizer.predict(face_gray)
-        except Exception:
-            label_id, conf = None, 999
-
-        if label_id is not None and conf < threshold:
-            name = labels.get(label_id, f"ID_{label_id}")
-            marked = mark_attendance_db(label_id, name, db_path)
-            results.append(
-                {
-                    "id": label_id,
-                    "name": name,
-                    "confidence": float(conf),
-                    "marked": marked,
-                    "debug": f"Recognized label_id={label_id}, conf={conf:.1f} < {threshold}",
-                }
-            )
-        # Skip unrecognized faces - don't add them to results
+    key = None
+    if cache is not None:
+        key = cache.key(
+            image_bytes,
+            model,
+            threshold=threshold,
+            scaleFactor=scaleFactor,
+            minNeighbors=minNeighbors,
+            minSize=list(minSize),
+            detect_scale=detect_scale,
+            db_path=os.path.abspath(db_path),
+            day=date.today().isoformat(),
+        )
+        hit = cache.get(key)
+        if hit is not None:
+            return None, hit["faces"], hit["results"]
 
-    return results
+    bgr, gray = decode_image(image_bytes)
+    if gray is None:
+        return None, [], {"error": "Could not decode uploaded image"}
+    faces = detect_image_faces(
+        gray,
+        detector or model.detector,
+        scaleFactor,
+        minNeighbors,
+        minSize,
+        detect_scale,
+    )
+    results = recognize_and_mark(
+        image_bytes,
+        db_path=db_path,
+        threshold=threshold,
+        gray=gray,
+        faces=faces,
+        model=model,
+    )
+    # errors are not cached, so a failed save is marked again on the next rerun
+    if key is not None and not isinstance(results, dict):
+        cache.put(key, {"faces": faces, "results": results})
+    return bgr, faces, results
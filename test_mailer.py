@@ -0,0 +1,125 @@
+"""MailSender against a local aiosmtpd server: python test_mailer.py (or pytest).
+
+Skipped when aiosmtpd (a test-only dependency) is not installed.
+"""
+import socket
+import sys
+from collections import Counter
+
+import pytest
+
+pytest.importorskip("aiosmtpd")
+
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+
+from mailer import MailSender
+
+HOST = "127.0.0.1"
+
+
+class Handler:
+    """Accepts everything, except: first delivery to temp@ gets a 451, bad@ always gets a 550."""
+
+    def __init__(self):
+        self.attempts = Counter()
+        self.delivered = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        self.attempts[address] += 1
+        if address.startswith("bad@"):
+            return "550 5.1.1 No such user"
+        if address.startswith("temp@") and self.attempts[address] == 1:
+            return "451 4.7.1 Try again later"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.delivered.extend(envelope.rcpt_tos)
+        return "250 OK"
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def _server(handler, **kwargs):
+    controller = Controller(handler, hostname=HOST, port=_free_port(), **kwargs)
+    controller.start()
+    return controller
+
+
+def _sender(controller, **config):
+    smtp = {"host": HOST, "port": controller.port, "security": "none", "user": None}
+    smtp.update(config)
+    return MailSender(smtp, pool_size=2, retry_backoff=0.01)
+
+
+def test_send_many_success():
+    handler = Handler()
+    controller = _server(handler)
+    try:
+        addresses = [f"s{i}@example.com" for i in range(5)]
+        sent, failed = _sender(controller).send_many([(a, "Absent", "body") for a in addresses])
+    finally:
+        controller.stop()
+    assert sorted(sent) == addresses and failed == []
+    assert sorted(handler.delivered) == addresses
+
+
+def test_4xx_is_retried():
+    handler = Handler()
+    controller = _server(handler)
+    try:
+        sent, failed = _sender(controller).send_many([("temp@example.com", "Absent", "body")])
+    finally:
+        controller.stop()
+    assert sent == ["temp@example.com"] and failed == []
+    assert handler.attempts["temp@example.com"] == 2
+
+
+def test_5xx_fails_without_retry():
+    handler = Handler()
+    controller = _server(handler)
+    try:
+        sent, failed = _sender(controller).send_many(
+            [("bad@example.com", "Absent", "body"), ("ok@example.com", "Absent", "body")]
+        )
+    finally:
+        controller.stop()
+    assert sent == ["ok@example.com"]
+    assert [email for email, _ in failed] == ["bad@example.com"]
+    assert handler.attempts["bad@example.com"] == 1
+
+
+def test_auth_failure_stops_the_batch():
+    sessions = []
+
+    def authenticator(server, session, envelope, mechanism, auth_data):
+        # smtplib tries each mechanism the server offers within one login()
+        if not any(s is session for s in sessions):
+            sessions.append(session)
+        return AuthResult(success=False, handled=False)
+
+    controller = _server(Handler(), authenticator=authenticator, auth_require_tls=False)
+    try:
+        messages = [(f"s{i}@example.com", "Absent", "body") for i in range(6)]
+        sent, failed = _sender(controller, user="me", **{"pass": "wrong"}).send_many(messages)
+    finally:
+        controller.stop()
+    assert sent == [] and len(failed) == 6
+    assert len(sessions) == 1
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_") and callable(fn):
+            try:
+                fn()
+                print(f"[+] {name}")
+            except Exception as e:
+                print(f"[!] {name} failed: {e!r}")
+                sys.exit(1)
+    print("Mailer OK")
@@ -2,22 +2,47 @@ import os
 import cv2
 import numpy as np
 from pathlib import Path
-from utils import save_labels, ensure_dir
+from utils import save_labels, load_labels, ensure_dir
 import argparse
+import hashlib
+import json
+import sys
+from functools import partial
+from multiprocessing import Pool
+from crop_cache import CropCache
+from face_utils import FACE_SIZE, normalize_face
+from lbph_model import save_binary_model
 
 CASCADE_PATH = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+MANIFEST_FILE = "manifest.json"
+# bumped when crops changed meaning (2: crops normalized to FACE_SIZE), forcing a full retrain
+MANIFEST_VERSION = 2
+CROP_CACHE_DIR = "crops"
+DEFAULT_CHUNK_SIZE = 256
 
-def gather_images(dataset_dir):
+# per-process detector, created lazily in each worker (and in the main process for workers=1)
+_detector = None
+
+
+def _get_detector():
+    global _detector
+    if _detector is None:
+        _detector = cv2.CascadeClassifier(CASCADE_PATH)
+    return _detector
+
+
+def scan_dataset(dataset_dir, known_labels=None):
     """
-    Walks dataset_dir, expects subdirectories per person.
-    Returns face_images list (grayscale arrays) and label_ids list.
-    Also returns labels_map: id -> name
+    Lists dataset_dir, expects subdirectories per person.
+    Returns labels_map (id -> name) and a list of (image_path, person_id) tasks.
+    Ids follow the sorted folder order, so they are deterministic. If known_labels
+    (id -> name) is given, those people keep their ids and new folders get ids
+    after the current maximum.
     """
-    detector = cv2.CascadeClassifier(CASCADE_PATH)
-    faces = []
-    ids = []
-    labels_map = {}
-    current_id = 0
+    labels_map = dict(known_labels or {})
+    name_to_id = {name: pid for pid, name in labels_map.items()}
+    tasks = []
+    current_id = max(labels_map, default=0)
 
     # sort directories for deterministic ids
     persons = sorted([d for d in os.listdir(dataset_dir) if os.path.isdir(os.path.join(dataset_dir, d))])
@@ -25,47 +50,169 @@ def gather_images(dataset_dir):
         raise RuntimeError(f"No person subfolders found in {dataset_dir}. Each person should be a folder containing images.")
 
     for person in persons:
-        current_id += 1
-        person_id = current_id
-        labels_map[person_id] = person
+        if person in name_to_id:
+            person_id = name_to_id[person]
+        else:
+            current_id += 1
+            person_id = current_id
+            labels_map[person_id] = person
         person_dir = os.path.join(dataset_dir, person)
         image_files = sorted([f for f in os.listdir(person_dir) if f.lower().endswith((".jpg", ".jpeg", ".png"))])
         if len(image_files) == 0:
             print(f"[!] Warning: no images for {person} in {person_dir}, skipping.")
             continue
         for img_name in image_files:
-            path = os.path.join(person_dir, img_name)
-            img = cv2.imread(path)
-            if img is None:
-                print(f"[!] Could not read {path}, skipping.")
-                continue
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            detected = detector.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30,30))
-            if len(detected) == 0:
-                # fallback: use whole image (useful if images are already cropped)
-                faces.append(gray)
-                ids.append(person_id)
-            else:
-                for (x,y,w,h) in detected:
-                    faces.append(gray[y:y+h, x:x+w])
-                    ids.append(person_id)
-    return faces, ids, labels_map
+            tasks.append((os.path.join(person_dir, img_name), person_id))
+    return labels_map, tasks
 
-def train(dataset_dir="dataset", model_dir="model"):
-    ensure_dir(model_dir)
-    print("[*] Gathering images...")
-    faces, ids, labels_map = gather_images(dataset_dir)
-    if len(faces) == 0:
-        print("[!] No faces gathered. Check dataset folder structure and images.")
+
+def detect_faces_in_file(task, cache_dir=None):
+    """
+    Decodes one image, runs Haar detection on it and normalizes each crop to FACE_SIZE.
+    Returns (path, person_id, crops); crops is None if the image could not be read.
+    With cache_dir, crops are looked up / stored by image content hash.
+    """
+    path, person_id = task
+    cache = CropCache(cache_dir) if cache_dir else None
+    if cache is not None:
+        digest = file_digest(path)
+        cached = cache.get(digest)
+        if cached is not None:
+            return path, person_id, cached
+    img = cv2.imread(path)
+    if img is None:
+        return path, person_id, None
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    detected = _get_detector().detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30,30))
+    if len(detected) == 0:
+        # fallback: use whole image (useful if images are already cropped)
+        crops = [normalize_face(gray)]
+    else:
+        crops = [normalize_face(gray[y:y+h, x:x+w]) for (x,y,w,h) in detected]
+    if cache is not None:
+        return path, person_id, cache.put(digest, crops)
+    return path, person_id, crops
+
+
+def iter_faces(tasks, workers=1, cache_dir=None):
+    """
+    Yields (path, person_id, crops) for each task in input order.
+    With workers > 1, decoding and detection fan out over a process pool and
+    results are streamed back as they complete (in order), so the caller never
+    waits for the whole dataset.
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield detect_faces_in_file(task, cache_dir)
         return
+    # keep cv2 from oversubscribing cores with its own threads inside each worker
+    with Pool(workers, initializer=cv2.setNumThreads, initargs=(1,)) as pool:
+        for result in pool.imap(partial(detect_faces_in_file, cache_dir=cache_dir), tasks, chunksize=4):
+            yield result
+
+
+def collect_faces(tasks, workers=1, cache_dir=None):
+    """
+    Runs detection over tasks and returns face_images list, label_ids list
+    and the list of (image_path, person_id) tasks that could be read.
+    """
+    faces = []
+    ids = []
+    used = []
+    for path, person_id, crops in iter_faces(tasks, workers, cache_dir):
+        if crops is None:
+            print(f"[!] Could not read {path}, skipping.")
+            continue
+        used.append((path, person_id))
+        for crop in crops:
+            faces.append(crop)
+            ids.append(person_id)
+    return faces, ids, used
+
+
+def iter_samples(tasks, workers=1, cache_dir=None, used=None):
+    """
+    Yields (crop, person_id) one face at a time, without holding the dataset in memory.
+    Tasks whose image could be read are appended to used, if given.
+    """
+    for path, person_id, crops in iter_faces(tasks, workers, cache_dir):
+        if crops is None:
+            print(f"[!] Could not read {path}, skipping.")
+            continue
+        if used is not None:
+            used.append((path, person_id))
+        for crop in crops:
+            yield crop, person_id
+
+
+def gather_images(dataset_dir, workers=1, cache_dir=None):
+    """
+    Walks dataset_dir, expects subdirectories per person.
+    Returns face_images list (grayscale arrays) and label_ids list.
+    Also returns labels_map: id -> name
+    """
+    labels_map, tasks = scan_dataset(dataset_dir)
+    faces, ids, _ = collect_faces(tasks, workers, cache_dir)
+    return faces, ids, labels_map
+
+
+def file_digest(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def manifest_entry(path, person_id, previous=None):
+    """Manifest record for one image; the content hash is reused while size and mtime are unchanged."""
+    st = os.stat(path)
+    if previous and previous["size"] == st.st_size and previous["mtime_ns"] == st.st_mtime_ns:
+        sha1 = previous["sha1"]
+    else:
+        sha1 = file_digest(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha1": sha1, "label": person_id}
+
+
+def load_manifest(model_dir):
+    """Return the image manifest (dataset-relative path -> entry) saved next to trainer.yml."""
+    path = os.path.join(model_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("version") != MANIFEST_VERSION:
+        return {}
+    return data.get("images", {})
+
+
+def save_manifest(model_dir, dataset_dir, used_tasks, previous=None):
+    previous = previous or {}
+    images = {}
+    for path, person_id in used_tasks:
+        rel = os.path.relpath(path, dataset_dir).replace(os.sep, "/")
+        images[rel] = manifest_entry(path, person_id, previous.get(rel))
+    path = os.path.join(model_dir, MANIFEST_FILE)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"version": MANIFEST_VERSION, "images": images}, f, indent=1, sort_keys=True)
+    return path
+
+
+def _create_recognizer():
     try:
-        recognizer = cv2.face.LBPHFaceRecognizer_create()
+        return cv2.face.LBPHFaceRecognizer_create()
     except AttributeError:
         raise RuntimeError("cv2.face not found. Install opencv-contrib-python (not plain opencv-python).")
-    print(f"[*] Training on {len(faces)} face samples from {len(labels_map)} people...")
-    recognizer.train(faces, np.array(ids))
+
+
+def _save_model(recognizer, labels_map, model_dir):
     trainer_path = os.path.join(model_dir, "trainer.yml")
-    recognizer.save(trainer_path)
+    # written aside and swapped in, so a running app never parses a half-written file
+    tmp_path = os.path.join(model_dir, "trainer.tmp.yml")
+    recognizer.save(tmp_path)
+    os.replace(tmp_path, trainer_path)
+    # same histograms in the binary format that model_registry memory-maps
+    save_binary_model(recognizer, model_dir, trainer_path)
     labels_path = os.path.join(model_dir, "labels.pickle")
     save_labels(labels_map, labels_path)
     print(f"[+] Training complete. Model saved to: {trainer_path}")
@@ -74,9 +221,174 @@ def train(dataset_dir="dataset", model_dir="model"):
     for k,v in labels_map.items():
         print(f"  {k}: {v}")
 
+def _current_rss():
+    """Current resident set size in bytes, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _peak_rss():
+    """Peak resident set size in bytes, or None where the resource module is unavailable (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def train_streaming(recognizer, samples, chunk_size=DEFAULT_CHUNK_SIZE, max_memory_mb=None, update=False):
+    """
+    Feeds (crop, person_id) samples into recognizer in fixed-size chunks:
+    the first chunk goes through train() (or update() when extending a loaded model)
+    and the rest are folded in with update(). max_memory_mb caps the chunk buffer,
+    and a chunk is also flushed early once the process RSS reaches the ceiling.
+    Returns the number of samples trained on.
+    """
+    max_bytes = max_memory_mb * 1024 * 1024 if max_memory_mb else None
+    crop_bytes = FACE_SIZE[0] * FACE_SIZE[1]
+    if max_bytes:
+        chunk_size = max(1, min(chunk_size, max_bytes // crop_bytes))
+    total = 0
+    faces = []
+    ids = []
+
+    def flush():
+        nonlocal update, total
+        if not faces:
+            return
+        if update:
+            recognizer.update(faces, np.array(ids))
+        else:
+            recognizer.train(faces, np.array(ids))
+            update = True
+        total += len(faces)
+        print(f"[*] Trained on {total} face samples so far...")
+        faces.clear()
+        ids.clear()
+
+    for crop, person_id in samples:
+        # copy out of the crop cache mmap so the chunk owns its memory
+        faces.append(np.array(crop))
+        ids.append(person_id)
+        if len(faces) >= chunk_size:
+            flush()
+        elif max_bytes and len(faces) % 32 == 0:
+            rss = _current_rss()
+            if rss is not None and rss >= max_bytes:
+                flush()
+    flush()
+
+    peak = _peak_rss()
+    if peak is not None:
+        print(f"[*] Peak RSS: {peak / (1024 * 1024):.1f} MB")
+        if max_bytes and peak > max_bytes:
+            # LBPH keeps one 64x256 float32 histogram per sample, which chunking cannot bound
+            print(f"[!] Peak RSS exceeded the {max_memory_mb} MB ceiling; the trained histograms themselves need more memory.")
+    return total
+
+def _cache_dir(model_dir, use_cache):
+    return os.path.join(model_dir, CROP_CACHE_DIR) if use_cache else None
+
+def train(dataset_dir="dataset", model_dir="model", workers=1, known_labels=None, use_cache=True, chunk_size=None, max_memory_mb=None):
+    ensure_dir(model_dir)
+    print("[*] Gathering images...")
+    if workers > 1:
+        print(f"[*] Using {workers} worker processes for decoding and detection")
+    labels_map, tasks = scan_dataset(dataset_dir, known_labels)
+    if chunk_size or max_memory_mb:
+        recognizer = _create_recognizer()
+        used = []
+        samples = iter_samples(tasks, workers, _cache_dir(model_dir, use_cache), used)
+        print(f"[*] Streaming training for {len(labels_map)} people...")
+        if train_streaming(recognizer, samples, chunk_size or DEFAULT_CHUNK_SIZE, max_memory_mb) == 0:
+            print("[!] No faces gathered. Check dataset folder structure and images.")
+            return
+    else:
+        faces, ids, used = collect_faces(tasks, workers, _cache_dir(model_dir, use_cache))
+        if len(faces) == 0:
+            print("[!] No faces gathered. Check dataset folder structure and images.")
+            return
+        recognizer = _create_recognizer()
+        print(f"[*] Training on {len(faces)} face samples from {len(labels_map)} people...")
+        recognizer.train(faces, np.array(ids))
+    _save_model(recognizer, labels_map, model_dir)
+    manifest_path = save_manifest(model_dir, dataset_dir, used, load_manifest(model_dir))
+    print(f"[+] Manifest saved to: {manifest_path}")
+
+def train_incremental(dataset_dir="dataset", model_dir="model", workers=1, use_cache=True, chunk_size=None, max_memory_mb=None):
+    """
+    Extends an existing model with images that are not in the manifest yet,
+    using LBPH update() instead of retraining. Existing people keep their ids.
+    Falls back to a full train() when there is no model/manifest or when images
+    were changed or removed (LBPH cannot drop samples it was trained on).
+    """
+    trainer_path = os.path.join(model_dir, "trainer.yml")
+    labels_path = os.path.join(model_dir, "labels.pickle")
+    manifest = load_manifest(model_dir)
+    if not os.path.exists(trainer_path) or not os.path.exists(labels_path) or not manifest:
+        print("[*] No existing model or manifest found, running full training.")
+        return train(dataset_dir, model_dir, workers, use_cache=use_cache, chunk_size=chunk_size, max_memory_mb=max_memory_mb)
+
+    known_labels = load_labels(labels_path)
+    labels_map, tasks = scan_dataset(dataset_dir, known_labels)
+    new_tasks = []
+    changed = []
+    seen = set()
+    for path, person_id in tasks:
+        rel = os.path.relpath(path, dataset_dir).replace(os.sep, "/")
+        seen.add(rel)
+        previous = manifest.get(rel)
+        if previous is None:
+            new_tasks.append((path, person_id))
+            continue
+        entry = manifest_entry(path, person_id, previous)
+        if entry["sha1"] != previous["sha1"] or entry["label"] != previous["label"]:
+            changed.append(rel)
+    removed = [rel for rel in manifest if rel not in seen]
+    if changed or removed:
+        print(f"[!] {len(changed)} changed and {len(removed)} removed image(s) since last training, running full training.")
+        return train(dataset_dir, model_dir, workers, known_labels, use_cache, chunk_size, max_memory_mb)
+    if not new_tasks:
+        print("[+] Model is up to date with the dataset, nothing to train.")
+        return
+
+    print(f"[*] Gathering {len(new_tasks)} new image(s)...")
+    recognizer = _create_recognizer()
+    recognizer.read(trainer_path)
+    if chunk_size or max_memory_mb:
+        used = []
+        samples = iter_samples(new_tasks, workers, _cache_dir(model_dir, use_cache), used)
+        if train_streaming(recognizer, samples, chunk_size or DEFAULT_CHUNK_SIZE, max_memory_mb, update=True) == 0:
+            print("[!] No faces gathered from new images.")
+            return
+    else:
+        faces, ids, used = collect_faces(new_tasks, workers, _cache_dir(model_dir, use_cache))
+        if len(faces) == 0:
+            print("[!] No faces gathered from new images.")
+            return
+        print(f"[*] Updating model with {len(faces)} face samples...")
+        recognizer.update(faces, np.array(ids))
+    _save_model(recognizer, labels_map, model_dir)
+    old_tasks = [(os.path.join(dataset_dir, rel), e["label"]) for rel, e in manifest.items()]
+    manifest_path = save_manifest(model_dir, dataset_dir, old_tasks + used, manifest)
+    print(f"[+] Manifest saved to: {manifest_path}")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--dataset", default="dataset", help="Path to dataset folder (subfolders per person)")
     parser.add_argument("--model-dir", default="model", help="Directory to save trained model and labels")
+    parser.add_argument("--workers", default=1, type=int, help="Worker processes for image decoding and face detection (0 = one per CPU)")
+    parser.add_argument("--incremental", action="store_true", help="Only process images missing from the manifest and update() the existing model")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the normalized face-crop cache under <model-dir>/crops")
+    parser.add_argument("--chunk-size", default=None, type=int, help=f"Stream face crops into the model in chunks of this many samples (streaming default: {DEFAULT_CHUNK_SIZE})")
+    parser.add_argument("--max-memory-mb", default=None, type=int, help="Memory ceiling for streaming training; bounds the chunk buffer and flushes early when RSS reaches it")
     args = parser.parse_args()
-    train(args.dataset, args.model_dir)
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    use_cache = not args.no_cache
+    if args.incremental:
+        train_incremental(args.dataset, args.model_dir, workers, use_cache, args.chunk_size, args.max_memory_mb)
+    else:
+        train(args.dataset, args.model_dir, workers, use_cache=use_cache, chunk_size=args.chunk_size, max_memory_mb=args.max_memory_mb)
@@ -1,6 +1,9 @@
+import base64
 import pickle
 import os
 import csv
+import hashlib
+import json
 import sqlite3
 from datetime import date
 import datetime
@@ -29,51 +32,229 @@ def load_labels(path="model/labels.pickle"):
         return pickle.load(f)
 
 
-def ensure_db(db_path):
-    # Resolve db_path relative to this file to avoid working-dir issues
+def resolve_db_path(db_path):
+    """Resolve db_path relative to this file to avoid working-dir issues."""
     if not os.path.isabs(db_path):
         db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), db_path)
+    return db_path
+
+
+# Schema migrations, applied in order. PRAGMA user_version records how many have run,
+# so existing databases are upgraded in place the first time ensure_db sees them.
+def _migration_create_attendance(conn):
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS attendance
+                    (id INTEGER, name TEXT, date TEXT, time TEXT)"""
+    )
+
 
-    # Create DB file and table if missing
-    if not os.path.exists(db_path):
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-        c.execute(
-            """CREATE TABLE IF NOT EXISTS attendance
-                        (id INTEGER, name TEXT, date TEXT, time TEXT)"""
+def _migration_attendance_indexes(conn):
+    # keep the earliest row of any (id, date) duplicates so the unique index can be built
+    cur = conn.execute(
+        """DELETE FROM attendance WHERE rowid NOT IN
+                (SELECT MIN(rowid) FROM attendance GROUP BY id, date)"""
+    )
+    if cur.rowcount:
+        print(f"[utils] collapsed {cur.rowcount} duplicate attendance row(s)")
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_id_date ON attendance (id, date)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_attendance_date ON attendance (date)")
+
+
+def _migration_email_outbox(conn):
+    # absent-notice jobs and their messages, drained by email_outbox.OutboxWorker
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS email_jobs
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL,
+                     date TEXT NOT NULL, smtp TEXT, created_at TEXT NOT NULL,
+                     finished_at TEXT)"""
+    )
+    # at most one scheduled job per day, however many processes run the scheduler
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_email_jobs_daily ON email_jobs (date) WHERE kind = 'daily'"
+    )
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS email_outbox
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT, job_id INTEGER NOT NULL,
+                     student_id INTEGER, to_email TEXT NOT NULL, subject TEXT,
+                     body TEXT, status TEXT NOT NULL DEFAULT 'pending',
+                     attempts INTEGER NOT NULL DEFAULT 0, available_at REAL NOT NULL DEFAULT 0,
+                     last_error TEXT, sent_at TEXT)"""
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_email_outbox_status ON email_outbox (status, available_at)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_email_outbox_job ON email_outbox (job_id, status)"
+    )
+
+
+def _migration_students(conn):
+    # roster imported from students.csv by sync_students; roster_sources records what was imported
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS students
+                    (id INTEGER PRIMARY KEY, name TEXT NOT NULL, email TEXT NOT NULL DEFAULT '')"""
+    )
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS roster_sources
+                    (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, sha1 TEXT,
+                     synced_at TEXT)"""
+    )
+
+
+def _migration_attendance_date_id_index(conn):
+    # (date, id) serves both date ranges and keyset pagination; it replaces the date-only index
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_attendance_date_id ON attendance (date, id)"
+    )
+    conn.execute("DROP INDEX IF EXISTS idx_attendance_date")
+
+
+def _migration_change_counters(conn):
+    # per-table write counters bumped by triggers, for cheap HTTP validators (see change_version)
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS change_counters
+                    (name TEXT PRIMARY KEY, version INTEGER NOT NULL, updated_at REAL NOT NULL)"""
+    )
+    now = "(julianday('now') - 2440587.5) * 86400.0"
+    for table in ("attendance", "students"):
+        conn.execute(
+            f"INSERT OR IGNORE INTO change_counters (name, version, updated_at) VALUES (?, 0, {now})",
+            (table,),
         )
-        conn.commit()
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(
+                f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version
+                    AFTER {event} ON {table} BEGIN
+                      UPDATE change_counters SET version = version + 1, updated_at = {now}
+                      WHERE name = '{table}';
+                    END"""
+            )
+
+
+def _migration_strip_smtp_secrets(conn):
+    # SMTP passwords are no longer stored with email jobs (see email_outbox.SECRET_KEYS)
+    for job_id, smtp in conn.execute("SELECT id, smtp FROM email_jobs WHERE smtp IS NOT NULL").fetchall():
+        try:
+            config = json.loads(smtp)
+        except ValueError:
+            config = None
+        if isinstance(config, dict):
+            config.pop("pass", None)
+        conn.execute(
+            "UPDATE email_jobs SET smtp = ? WHERE id = ?",
+            (json.dumps(config) if config else None, job_id),
+        )
+
+
+MIGRATIONS = [
+    _migration_create_attendance,
+    _migration_attendance_indexes,
+    _migration_email_outbox,
+    _migration_students,
+    _migration_attendance_date_id_index,
+    _migration_change_counters,
+    _migration_strip_smtp_secrets,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+_migrated = set()
+
+
+def migrate_db(db_path):
+    """Apply pending schema migrations to db_path. Returns the resulting schema version."""
+    db_path = resolve_db_path(db_path)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return version
+        # IMMEDIATE takes the write lock up front so concurrent processes migrate one at a time
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for i in range(version, SCHEMA_VERSION):
+                MIGRATIONS[i](conn)
+                print(f"[utils] applied schema migration {i + 1} ({MIGRATIONS[i].__name__})")
+            conn.execute(f"PRAGMA user_version = {max(version, SCHEMA_VERSION)}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return max(version, SCHEMA_VERSION)
+    finally:
         conn.close()
+
+
+def ensure_db(db_path):
+    # Resolve db_path relative to this file to avoid working-dir issues
+    db_path = resolve_db_path(db_path)
+
+    # Create DB file / upgrade its schema once per process
+    if db_path in _migrated and os.path.exists(db_path):
+        return
+    migrate_db(db_path)
+    _migrated.add(db_path)
     # Small debug trace
     print(f"[utils] ensure_db using: {db_path}")
 
 
+def change_version(db_path, *names):
+    """
+    Current write counters of the given tables ("attendance", "students") as
+    ({name: version}, last modified unix time). The counters are bumped by
+    triggers on every row change, so they work for writes from any process.
+    """
+    db_path = resolve_db_path(db_path)
+    ensure_db(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(
+            f"SELECT name, version, updated_at FROM change_counters WHERE name IN ({','.join('?' * len(names))})",
+            names,
+        ).fetchall()
+    finally:
+        conn.close()
+    return {r[0]: r[1] for r in rows}, max((r[2] for r in rows), default=0.0)
+
+
+def roster_hash(csv_path="students.csv", db_path="attendance.db"):
+    """sha1 of the students.csv content last imported into db_path, or None."""
+    db_path = resolve_db_path(db_path)
+    ensure_db(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute(
+            "SELECT sha1 FROM roster_sources WHERE path = ?", (os.path.abspath(csv_path),)
+        ).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+
 def mark_attendance_db(id_val: int, name: str, db_path: str = "attendance.db") -> bool:
     """Insert attendance for today if not already present. Returns True if inserted, False if already present."""
     # Resolve and ensure DB
-    if not os.path.isabs(db_path):
-        db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), db_path)
+    db_path = resolve_db_path(db_path)
     ensure_db(db_path)
     conn = sqlite3.connect(db_path)
     cur = conn.cursor()
     today = date.today().isoformat()
-    cur.execute(
-        "SELECT 1 FROM attendance WHERE id = ? AND date = ? LIMIT 1", (id_val, today)
-    )
-    exists = cur.fetchone()
-    if exists:
-        conn.close()
-        print(
-            f"[utils] attendance already exists for id={id_val} on {today} (db={db_path})"
-        )
-        return False
     now = datetime.datetime.now().strftime("%H:%M:%S")
+    # the unique (id, date) index turns duplicates into a no-op
     cur.execute(
-        "INSERT INTO attendance (id, name, date, time) VALUES (?, ?, ?, ?)",
+        "INSERT OR IGNORE INTO attendance (id, name, date, time) VALUES (?, ?, ?, ?)",
         (id_val, name, today, now),
     )
+    inserted = cur.rowcount == 1
     conn.commit()
     conn.close()
+    if not inserted:
+        print(
+            f"[utils] attendance already exists for id={id_val} on {today} (db={db_path})"
+        )
+        return False
     print(
         f"[utils] marked attendance for id={id_val} name={name} on {today} at {now} (db={db_path})"
     )
@@ -97,6 +278,110 @@ def get_attendance(db_path="attendance.db", date_str: str = None):
     return rows
 
 
+def encode_cursor(date_str: str, id_val: int) -> str:
+    """Opaque keyset cursor for the attendance row (date_str, id_val)."""
+    return base64.urlsafe_b64encode(f"{date_str}|{id_val}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """Inverse of encode_cursor. Raises ValueError for a malformed cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        date_str, id_val = raw.split("|")
+        return date_str, int(id_val)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def _attendance_filters(date_from, date_to, student_id):
+    where, params = [], []
+    if date_from:
+        where.append("date >= ?")
+        params.append(date_from)
+    if date_to:
+        where.append("date <= ?")
+        params.append(date_to)
+    if student_id is not None:
+        where.append("id = ?")
+        params.append(int(student_id))
+    return where, params
+
+
+def query_attendance(
+    db_path="attendance.db",
+    date_from: str = None,
+    date_to: str = None,
+    student_id: int = None,
+    cursor: str = None,
+    limit: int = None,
+):
+    """
+    Attendance rows (id, name, date, time) ordered by (date, id), filtered by an
+    inclusive date range and/or student. Pages are keyset-based: pass the
+    returned cursor back to continue after the last row. Returns
+    (rows, next_cursor); next_cursor is None on the last page.
+    """
+    db_path = resolve_db_path(db_path)
+    ensure_db(db_path)
+    where, params = _attendance_filters(date_from, date_to, student_id)
+    if cursor:
+        where.append("(date, id) > (?, ?)")
+        params += list(decode_cursor(cursor))
+    sql = "SELECT id, name, date, time FROM attendance"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY date, id"
+    if limit is not None:
+        # one extra row tells whether there is another page
+        sql += " LIMIT ?"
+        params.append(int(limit) + 1)
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][2], rows[-1][0])
+    return rows, next_cursor
+
+
+def attendance_summary(
+    db_path="attendance.db",
+    date_from: str = None,
+    date_to: str = None,
+    student_id: int = None,
+    group_by: str = "day",
+):
+    """
+    Aggregated attendance computed in SQL. group_by="day" gives
+    [{date, present}] per date; group_by="student" gives
+    [{id, name, days, first, last}] per student.
+    """
+    db_path = resolve_db_path(db_path)
+    ensure_db(db_path)
+    where, params = _attendance_filters(date_from, date_to, student_id)
+    clause = (" WHERE " + " AND ".join(where)) if where else ""
+    if group_by == "day":
+        sql = f"SELECT date, COUNT(*) FROM attendance{clause} GROUP BY date ORDER BY date"
+        keys = ("date", "present")
+    elif group_by == "student":
+        sql = (
+            f"SELECT id, MAX(name), COUNT(*), MIN(date), MAX(date) FROM attendance{clause}"
+            " GROUP BY id ORDER BY id"
+        )
+        keys = ("id", "name", "days", "first", "last")
+    else:
+        raise ValueError(f"group_by must be 'day' or 'student', not {group_by!r}")
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+    return [dict(zip(keys, r)) for r in rows]
+
+
 def load_students(csv_path="students.csv"):
     """Return list of dicts: [{id:int,name:str,email:str}, ...]"""
     if not os.path.exists(csv_path):
@@ -118,6 +403,122 @@ def load_students(csv_path="students.csv"):
     return out
 
 
+# (db_path, csv_path) -> (mtime_ns, size) of the CSV last imported or confirmed unchanged
+_roster_stat = {}
+
+
+def sync_students(csv_path="students.csv", db_path="attendance.db") -> bool:
+    """
+    Import csv_path into the students table if it changed since the last import.
+    A changed mtime/size alone only triggers a re-import when the content hash
+    differs too. A missing CSV leaves the stored roster as it is.
+    Returns True if the table was rewritten.
+    """
+    db_path = resolve_db_path(db_path)
+    csv_path = os.path.abspath(csv_path)
+    try:
+        st = os.stat(csv_path)
+    except OSError:
+        return False
+    key = (db_path, csv_path)
+    stat = (st.st_mtime_ns, st.st_size)
+    if _roster_stat.get(key) == stat:
+        return False
+    ensure_db(db_path)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        row = conn.execute(
+            "SELECT mtime_ns, size, sha1 FROM roster_sources WHERE path = ?", (csv_path,)
+        ).fetchone()
+        if row is not None and tuple(row[:2]) == stat:
+            _roster_stat[key] = stat
+            return False
+        with open(csv_path, "rb") as f:
+            sha1 = hashlib.sha1(f.read()).hexdigest()
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            changed = row is None or row[2] != sha1
+            if changed:
+                students = load_students(csv_path)
+                conn.execute("DELETE FROM students")
+                conn.executemany(
+                    "INSERT OR REPLACE INTO students (id, name, email) VALUES (?, ?, ?)",
+                    [(s["id"], s["name"], s["email"]) for s in students],
+                )
+            conn.execute(
+                "INSERT OR REPLACE INTO roster_sources (path, mtime_ns, size, sha1, synced_at) VALUES (?, ?, ?, ?, ?)",
+                (csv_path, stat[0], stat[1], sha1, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    _roster_stat[key] = stat
+    if changed:
+        print(f"[utils] imported {len(students)} student(s) from {csv_path}")
+    return changed
+
+
+def query_students(
+    db_path="attendance.db",
+    csv_path="students.csv",
+    q: str = None,
+    ids=None,
+    has_email: bool = None,
+    absent_on: str = None,
+    limit: int = None,
+    offset: int = 0,
+):
+    """
+    Students from the roster table (synced from csv_path first), ordered by id.
+    q matches name or email (case-insensitive substring), ids restricts to those
+    ids, has_email filters on whether an email is set, and absent_on=YYYY-MM-DD
+    keeps only students with no attendance row on that date.
+    """
+    db_path = resolve_db_path(db_path)
+    sync_students(csv_path, db_path)
+    ensure_db(db_path)
+    sql = "SELECT s.id, s.name, s.email FROM students s"
+    where, params = [], []
+    if absent_on:
+        # anti-join on the unique (id, date) index
+        where.append(
+            "NOT EXISTS (SELECT 1 FROM attendance a WHERE a.id = s.id AND a.date = ?)"
+        )
+        params.append(absent_on)
+    if q:
+        where.append("(s.name LIKE ? OR s.email LIKE ?)")
+        params += [f"%{q}%", f"%{q}%"]
+    if ids:
+        ids = [int(i) for i in ids]
+        where.append(f"s.id IN ({','.join('?' * len(ids))})")
+        params += ids
+    if has_email is not None:
+        where.append("s.email != ''" if has_email else "s.email = ''")
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY s.id"
+    if limit is not None:
+        sql += " LIMIT ? OFFSET ?"
+        params += [int(limit), int(offset)]
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+    return [{"id": r[0], "name": r[1], "email": r[2]} for r in rows]
+
+
+def absent_students(csv_path="students.csv", db_path="attendance.db", date_str=None):
+    """Students in the roster with no attendance row on date_str (defaults to today)."""
+    if date_str is None:
+        date_str = date.today().isoformat()
+    return query_students(db_path, csv_path, absent_on=date_str)
+
+
 def send_email(smtp_config: Dict, to_email: str, subject: str, body: str):
     """Send a simple plaintext email using smtp_config dict with keys:
     host, port, user, pass, use_tls (bool)
@@ -148,29 +549,37 @@ def send_email(smtp_config: Dict, to_email: str, subject: str, body: str):
         server.quit()
 
 
+def absent_notice(name: str, date_str: str):
+    """Subject and body of the absent notice sent to one student."""
+    subject = f"Absent Notice for {date_str}"
+    body = f"Hello {name},\n\nYou were marked absent on {date_str}. If this is a mistake, please contact the administration.\n\nRegards,\nAttendance System"
+    return subject, body
+
+
 def send_absent_emails(
     smtp_config: Dict,
     csv_path: str = "students.csv",
     db_path: str = "attendance.db",
     date_str: str = None,
+    pool_size: int = 4,
+    rate_limit: float = None,
 ):
     """Sends email to students who are in students.csv but not in attendance table for date_str (defaults to today).
+    Messages go out over a pool of reused SMTP sessions (see mailer.MailSender).
     Returns list of sent emails.
     """
+    from mailer import MailSender
+
     if date_str is None:
         date_str = date.today().isoformat()
-    students = load_students(csv_path)
-    attendance_rows = get_attendance(db_path, date_str)
-    attended_ids = {r[0] for r in attendance_rows}
-    sent = []
-    for s in students:
-        if s["id"] not in attended_ids and s["email"]:
-            subject = f"Absent Notice for {date_str}"
-            body = f"Hello {s['name']},\n\nYou were marked absent on {date_str}. If this is a mistake, please contact the administration.\n\nRegards,\nAttendance System"
-            try:
-                send_email(smtp_config, s["email"], subject, body)
-                sent.append(s["email"])
-            except Exception as e:
-                # For a production system we would log details
-                print(f"[!] Failed to send email to {s['email']}: {e}")
+    messages = []
+    for s in absent_students(csv_path, db_path, date_str):
+        if s["email"]:
+            subject, body = absent_notice(s["name"], date_str)
+            messages.append((s["email"], subject, body))
+    sender = MailSender(smtp_config, pool_size=pool_size, rate_limit=rate_limit)
+    sent, failed = sender.send_many(messages)
+    for email, err in failed:
+        # For a production system we would log details
+        print(f"[!] Failed to send email to {email}: {err}")
     return sent